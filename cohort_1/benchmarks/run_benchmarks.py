@@ -0,0 +1,378 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.append("../common")
+from fake_llm import AsyncFakeLLM, LatencyModel
+from stand_ins import (
+    LatencyRecorder,
+    StandInCrossEncoder,
+    StandInReranker,
+    StandInTable,
+    make_eval_questions,
+    make_reviews,
+    make_tool_list,
+    make_tool_questions,
+)
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+COHORT_DIR = BENCHMARK_DIR.parent
+DEFAULT_BASELINE = BENCHMARK_DIR / "baseline.json"
+DEFAULT_OUTPUT = BENCHMARK_DIR / "benchmark_results.json"
+
+# Number of questions (or chunks) per run, for each benchmark
+DEFAULT_SIZES = {
+    "reranked_search": [100, 1000, 5000],
+    "eval_sbert": [100, 1000, 5000],
+    "synthetic_dataset": [100, 500, 2000],
+    "tool_call_evals": [100, 1000, 5000],
+}
+# Stand-in settings. They are saved with the results, and a baseline is only
+# comparable to runs with the same config
+CONFIG = {
+    "corpus_size": 2000,
+    "n_to_rerank": 40,
+    "search_latency_s": 0.002,
+    "llm_latency_median_s": 0.05,
+    "llm_latency_sigma": 0.3,
+    "seed": 0,
+}
+# Gated metrics, and whether higher values are better
+METRICS = {"qps": True, "p50_ms": False, "p95_ms": False, "peak_rss_mb": False}
+# Latency changes smaller than this are timer noise, not regressions
+MIN_LATENCY_CHANGE_MS = 1.0
+
+# A benchmark's setup takes the dataset size and returns the timed run and the
+# recorder its stand-ins add latencies to. A run may return (p50_ms, p95_ms)
+# itself when the pipeline measures latency, as evaluate_model does.
+Setup = Callable[[int], Tuple[Callable[[], Any], LatencyRecorder]]
+
+
+def enter_week(folder: str):
+    """Run from a week's folder, as its scripts expect, and import from it."""
+    os.chdir(COHORT_DIR / folder)
+    sys.path.insert(0, str(COHORT_DIR / folder))
+    # The modules create their OpenAI clients on import; the stand-ins never use them
+    os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+
+
+def fake_llm() -> AsyncFakeLLM:
+    return AsyncFakeLLM(
+        latency=LatencyModel(
+            median=CONFIG["llm_latency_median_s"], sigma=CONFIG["llm_latency_sigma"]
+        ),
+        seed=CONFIG["seed"],
+    )
+
+
+def setup_reranked_search(size: int):
+    enter_week("week1_bootstrap_evals")
+    import scoring_utils
+    from candidate_cache import CandidateStore
+
+    reviews = make_reviews(CONFIG["corpus_size"], CONFIG["seed"])
+    table = StandInTable(reviews, search_latency=CONFIG["search_latency_s"])
+    questions = [
+        scoring_utils.EvalQuestion(**q)
+        for q in make_eval_questions(reviews, size, CONFIG["seed"])
+    ]
+    recorder = LatencyRecorder()
+    # A fresh candidate store, so every search is a cache miss
+    store = CandidateStore(tempfile.mkdtemp(prefix="candidates-"))
+    store.get = recorder.timed(store.get, key=lambda table, query, *args: query)
+    scoring_utils.get_candidate_store = lambda: store
+    reranker = StandInReranker(recorder=recorder)
+
+    def run():
+        scoring_utils.score_reranked_search(
+            questions, table, [1, 5, 10], CONFIG["n_to_rerank"], reranker=reranker
+        )
+
+    return run, recorder
+
+
+def setup_eval_sbert(size: int):
+    enter_week("week5_fine_tuning")
+    import eval_sbert
+    from candidate_cache import CandidateStore
+
+    reviews = make_reviews(CONFIG["corpus_size"], CONFIG["seed"])
+    eval_sbert.reviews_table = StandInTable(
+        reviews, search_latency=CONFIG["search_latency_s"]
+    )
+    eval_sbert.eval_questions = [
+        eval_sbert.EvalQuestion(**q)
+        for q in make_eval_questions(reviews, size, CONFIG["seed"])
+    ]
+    store = CandidateStore(tempfile.mkdtemp(prefix="candidates-"))
+    eval_sbert.get_candidate_store = lambda: store
+    model = StandInCrossEncoder()
+
+    def run():
+        *_, p50_ms, p95_ms = eval_sbert.evaluate_model(model, "Stand-in model")
+        return p50_ms, p95_ms
+
+    return run, LatencyRecorder()
+
+
+def setup_synthetic_dataset(size: int):
+    enter_week("week1_bootstrap_evals")
+    import make_synthetic_questions
+
+    make_synthetic_questions.client = fake_llm()
+    recorder = LatencyRecorder()
+    make_synthetic_questions.generate_evals = recorder.atimed(
+        make_synthetic_questions.generate_evals, key=lambda chunk, *args: chunk.id
+    )
+    chunks = [
+        make_synthetic_questions.TextChunk(id=str(row["id"]), content=row["review"])
+        for row in make_reviews(size, CONFIG["seed"])
+    ]
+    example_questions = ["What does the reviewer like about the product?"]
+
+    def run():
+        asyncio.run(
+            make_synthetic_questions.create_synthetic_dataset(
+                chunks, 2, example_questions
+            )
+        )
+
+    return run, recorder
+
+
+def setup_tool_call_evals(size: int):
+    enter_week("week4_routing")
+    import utils
+
+    utils.async_client = fake_llm()
+    recorder = LatencyRecorder()
+    utils.get_one_tool_call_eval = recorder.atimed(
+        utils.get_one_tool_call_eval, key=lambda q, *args: id(q)
+    )
+    questions = [
+        utils.QuestionWithTools(**q) for q in make_tool_questions(size, CONFIG["seed"])
+    ]
+    tool_list = make_tool_list()
+
+    def run():
+        asyncio.run(utils.get_all_tool_call_evals(questions, tool_list))
+
+    return run, recorder
+
+
+BENCHMARKS: Dict[str, Setup] = {
+    "reranked_search": setup_reranked_search,
+    "eval_sbert": setup_eval_sbert,
+    "synthetic_dataset": setup_synthetic_dataset,
+    "tool_call_evals": setup_tool_call_evals,
+}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_worker(name: str, size: int, output: str):
+    """
+    Run one benchmark at one size and write its measurements to `output`.
+
+    Each (benchmark, size) gets its own process, so peak RSS belongs to that
+    run alone and no module state leaks between runs.
+    """
+    run, recorder = BENCHMARKS[name](size)
+    setup_rss_mb = peak_rss_mb()
+    start = time.perf_counter()
+    latencies = run()
+    seconds = time.perf_counter() - start
+    p50_ms, p95_ms = latencies or recorder.percentiles_ms()
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "n": size,
+                "seconds": seconds,
+                "qps": size / seconds,
+                "p50_ms": p50_ms,
+                "p95_ms": p95_ms,
+                "setup_rss_mb": setup_rss_mb,
+                "peak_rss_mb": peak_rss_mb(),
+            },
+            f,
+        )
+
+
+def run_benchmark(name: str, size: int, repeats: int = 1) -> Optional[Dict[str, Any]]:
+    """
+    Run a benchmark `repeats` times in fresh processes and keep the fastest run,
+    which is the least disturbed by other load on the machine.
+    """
+    best = None
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "result.json")
+            process = subprocess.run(
+                [sys.executable, __file__, "--worker", name, str(size), output],
+                cwd=BENCHMARK_DIR,
+                # Scratch stores made by the worker are removed with this directory
+                env={**os.environ, "TMPDIR": directory},
+                capture_output=True,
+                text=True,
+            )
+            if process.returncode != 0:
+                print(f"{name}@{size} failed:\n{process.stderr[-2000:]}")
+                return None
+            with open(output) as f:
+                result = json.load(f)
+        if best is None or result["qps"] > best["qps"]:
+            best = result
+    return best
+
+
+def compare(
+    results: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Dict[str, Dict[str, Dict[str, float]]],
+    tolerance: float,
+) -> List[str]:
+    """
+    Compare results to a baseline and print the relative change of each metric.
+
+    Args:
+        results: benchmark -> size -> metrics, as written by this script.
+        baseline: The same structure, from an earlier run.
+        tolerance (float): Relative change allowed before a metric counts as a
+            regression, e.g. 0.25 for 25%.
+
+    Returns:
+        List[str]: One line per regressed metric, and per result missing from the
+            baseline. Empty if nothing regressed.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<28}" + "".join(f"{m:>21}  " for m in METRICS))
+    for name, sizes in results.items():
+        for size, metrics in sizes.items():
+            previous = baseline.get(name, {}).get(size)
+            if previous is None:
+                # An unmeasured size must not pass silently
+                regressions.append(
+                    f"{name}@{size}: not in the baseline, run with --update-baseline"
+                )
+                continue
+            row = f"{name + '@' + size:<28}"
+            for metric, higher_is_better in METRICS.items():
+                old, new = previous[metric], metrics[metric]
+                change = (new - old) / old if old else 0.0
+                worse = -change if higher_is_better else change
+                regressed = worse > tolerance and not (
+                    metric.endswith("_ms") and abs(new - old) < MIN_LATENCY_CHANGE_MS
+                )
+                marker = " !" if regressed else "  "
+                row += f"{new:>12.1f} ({change:+6.1%}){marker}"
+                if regressed:
+                    regressions.append(
+                        f"{name}@{size} {metric}: {old:.1f} -> {new:.1f} ({change:+.1%})"
+                    )
+            print(row)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the eval pipelines against local stand-ins."
+    )
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, help="Overrides each benchmark's sizes"
+    )
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--output", default=str(DEFAULT_OUTPUT))
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Save these results into the baseline instead of comparing",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--worker", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        name, size, output = args.worker
+        run_worker(name, int(size), output)
+        return
+
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    failed = False
+    for name in args.benchmarks or list(BENCHMARKS):
+        for size in args.sizes or DEFAULT_SIZES[name]:
+            result = run_benchmark(name, size, args.repeats)
+            if result is None:
+                failed = True
+                continue
+            results.setdefault(name, {})[str(size)] = result
+            print(
+                f"{name}@{size}: {result['qps']:.1f} q/s, "
+                f"p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, "
+                f"peak RSS {result['peak_rss_mb']:.0f} MB"
+            )
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": CONFIG,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.update_baseline:
+        baseline = report
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            for name, sizes in results.items():
+                baseline["results"].setdefault(name, {}).update(sizes)
+            baseline.update(created=report["created"], machine=report["machine"])
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != CONFIG or baseline["machine"] != report["machine"]:
+            print(
+                "Warning: the baseline was recorded with a different config or machine"
+            )
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            failed = True
+        else:
+            print("\nNo regressions.")
+    else:
+        print(
+            f"No baseline at {args.baseline}, so nothing was compared. "
+            "Record one with --update-baseline"
+        )
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import functools
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.append("../common")
+from embedding_cache import hashing_embedder
+
+SYLLABLES = "ba ker lo mi sa tor ven du ri pel zan co".split()
+TOOL_NAMES = [
+    "SearchProductManual",
+    "CheckOrderStatus",
+    "CompareProducts",
+    "FindCompatibleAccessories",
+    "GetWarrantyInfo",
+    "EstimateShipping",
+    "LookupReturnPolicy",
+    "ComputeDimensions",
+]
+
+
+def make_vocabulary(n_words: int = 2000, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < n_words:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_reviews(
+    n_reviews: int, seed: int = 0, words_per_review: Tuple[int, int] = (20, 80)
+) -> List[Dict[str, Any]]:
+    """
+    Synthetic reviews shaped like the week1 reviews table rows. Words follow a
+    Zipf-like distribution, so lexical overlap behaves like real text.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(seed=seed)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    return [
+        {
+            "id": i,
+            "review": " ".join(
+                rng.choices(vocabulary, weights, k=rng.randint(*words_per_review))
+            ),
+        }
+        for i in range(n_reviews)
+    ]
+
+
+def make_eval_questions(
+    reviews: List[Dict[str, Any]], n_questions: int, seed: int = 0
+) -> List[Dict[str, str]]:
+    """
+    EvalQuestion fields for questions that quote a few words of a random review.
+    """
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(n_questions):
+        review = rng.choice(reviews)
+        words = review["review"].split()
+        start = rng.randrange(max(len(words) - 8, 1))
+        question = f"What does the review say about {' '.join(words[start:start + 8])}?"
+        questions.append(
+            {
+                "question": question,
+                "answer": " ".join(words[start + 8 : start + 20]),
+                "chunk_id": str(review["id"]),
+                "question_with_context": question,
+            }
+        )
+    return questions
+
+
+def make_tool_questions(n_questions: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    QuestionWithTools fields, each needing one to three of TOOL_NAMES.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(seed=seed)
+    return [
+        {
+            "question": " ".join(rng.choices(vocabulary, k=rng.randint(8, 20))) + "?",
+            "required_tools": {
+                "func_names": rng.sample(TOOL_NAMES, k=rng.randint(1, 3))
+            },
+        }
+        for _ in range(n_questions)
+    ]
+
+
+def make_tool_list() -> str:
+    return "\n".join(f"- {name}: stand-in tool {name}" for name in TOOL_NAMES)
+
+
+class LatencyRecorder:
+    """
+    Per-request latency, summed over the calls made for each request key.
+
+    A request can touch several stages (first-stage search, then reranking),
+    possibly from different threads, so samples are accumulated by key and each
+    key's total is one latency sample.
+    """
+
+    def __init__(self):
+        self.totals: Dict[Hashable, float] = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def add(self, key: Hashable, seconds: float):
+        with self.lock:
+            self.totals[key] += seconds
+
+    def timed(self, func: Callable, key: Callable[..., Hashable]) -> Callable:
+        """Wrap a function so each call adds its duration under key(*args)."""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(key(*args, **kwargs), time.perf_counter() - start)
+
+        return wrapper
+
+    def atimed(self, func: Callable, key: Callable[..., Hashable]) -> Callable:
+        """Like timed, for coroutine functions."""
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.add(key(*args, **kwargs), time.perf_counter() - start)
+
+        return wrapper
+
+    def percentiles_ms(self) -> Tuple[float, float]:
+        if not self.totals:
+            return 0.0, 0.0
+        p50, p95 = np.percentile(list(self.totals.values()), [50, 95]) * 1000
+        return float(p50), float(p95)
+
+
+class StandInQuery:
+    def __init__(self, table: "StandInTable", query: str):
+        self.table = table
+        self.query = query
+        self.columns: Optional[List[str]] = None
+        self.n_results = 10
+
+    def select(self, columns: List[str]) -> "StandInQuery":
+        self.columns = list(columns)
+        return self
+
+    def limit(self, n_results: int) -> "StandInQuery":
+        self.n_results = n_results
+        return self
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        table = self.table
+        if table.search_latency:
+            time.sleep(table.search_latency)
+        scores = table.vectors @ table.embedder([self.query])[0]
+        n_results = min(self.n_results, len(scores))
+        top = np.argpartition(-scores, n_results - 1)[:n_results]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        columns = self.columns or list(table.rows[0])
+        return [
+            {
+                **{column: table.rows[i][column] for column in columns},
+                "_distance": float(2.0 - 2.0 * scores[i]),
+            }
+            for i in top
+        ]
+
+
+class StandInTable:
+    """
+    Local stand-in for the LanceDB reviews table. It supports the
+    `search(query).select(columns).limit(n).to_list()` chain used by
+    CandidateStore, with exact search over hashing-embedder vectors.
+    `search_latency` seconds are slept per search, like a network round trip.
+    """
+
+    def __init__(
+        self,
+        rows: List[Dict[str, Any]],
+        name: str = "reviews",
+        dimensions: int = 256,
+        search_latency: float = 0.0,
+    ):
+        self.name = name
+        self.version = 1
+        self.rows = rows
+        self.embedder = hashing_embedder(dimensions)
+        self.vectors = self.embedder([row["review"] for row in rows])
+        self.search_latency = search_latency
+
+    def search(self, query: str) -> StandInQuery:
+        return StandInQuery(self, query)
+
+
+class StandInCrossEncoder:
+    """
+    Local stand-in for a sentence-transformers CrossEncoder. `predict` scores
+    (query, passage) pairs by hashing-embedder cosine similarity, so its cost
+    grows with the number of pairs like a forward pass, and `rank` returns
+    CrossEncoder.rank's format.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.embedder = hashing_embedder(dimensions)
+
+    def predict(
+        self, sentences: Sequence[Sequence[str]], batch_size: int = 32, **kwargs
+    ) -> np.ndarray:
+        if not len(sentences):
+            return np.zeros(0, dtype=np.float32)
+        # A query is paired with all of its candidates, so embed each text once
+        texts = list(dict.fromkeys(text for pair in sentences for text in pair))
+        row = {text: i for i, text in enumerate(texts)}
+        vectors = self.embedder(texts)
+        queries = vectors[[row[query] for query, _ in sentences]]
+        passages = vectors[[row[passage] for _, passage in sentences]]
+        return np.einsum("ij,ij->i", queries, passages)
+
+    def rank(
+        self, query: str, documents: List[str], top_k: Optional[int] = None, **kwargs
+    ) -> List[Dict[str, Any]]:
+        scores = self.predict([[query, document] for document in documents])
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [{"corpus_id": int(i), "score": float(scores[i])} for i in order]
+
+
+class StandInReranker:
+    """
+    Reranker (see week1_bootstrap_evals/rerankers.py) backed by a
+    StandInCrossEncoder. Each query is reranked separately, like
+    CohereReranker, and its time is added to `recorder` under the query text.
+    """
+
+    name = "stand-in"
+
+    def __init__(
+        self,
+        model: Optional[StandInCrossEncoder] = None,
+        recorder: Optional[LatencyRecorder] = None,
+    ):
+        self.model = model or StandInCrossEncoder()
+        self.recorder = recorder
+
+    def rerank(self, query: str, documents: List[str]) -> List[Tuple[int, float]]:
+        start = time.perf_counter()
+        ordering = [
+            (result["corpus_id"], result["score"])
+            for result in self.model.rank(query, documents)
+        ]
+        if self.recorder is not None:
+            self.recorder.add(query, time.perf_counter() - start)
+        return ordering
+
+    def rerank_many(
+        self, queries: List[str], documents: List[List[str]]
+    ) -> List[List[Tuple[int, float]]]:
+        return [self.rerank(query, docs) for query, docs in zip(queries, documents)]
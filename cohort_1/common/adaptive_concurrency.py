@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# The slot held by the current task, so code deep inside a request can report a
+# failure it handled itself (see record_error)
+_current_slot: ContextVar[Optional[dict]] = ContextVar("_current_slot", default=None)
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """
+    Whether an error means the provider is overloaded: 429s, 5xxs and timeouts,
+    including when they are wrapped by another exception (e.g. by instructor).
+    """
+    while error is not None:
+        if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+            return True
+        if "Timeout" in type(error).__name__:
+            return True
+        if getattr(error, "status_code", None) in OVERLOAD_STATUS_CODES:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def record_error(error: BaseException):
+    """
+    Report an error that was caught inside an `async with limiter:` block.
+
+    Call sites that log and swallow exceptions (returning None or []) use this
+    so the limiter still sees 429s and timeouts.
+    """
+    slot = _current_slot.get()
+    if slot is not None:
+        slot["error"] = error
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limiter for async LLM fan-out, used like a semaphore:
+
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10)
+        async with limiter:
+            await client.chat.completions.create(...)
+
+    While requests succeed with latency close to the recent average, the
+    limit grows additively (about +1 per `limit` completions, i.e. per round
+    trip). On a 429, 5xx or timeout, or when the smoothed latency exceeds
+    `latency_tolerance` times the baseline (the average over the last
+    `baseline_window` completions), it is cut multiplicatively, at most once
+    per round trip so one burst of failures causes a single backoff.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 200,
+        increase: float = 1.0,
+        backoff_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        latency_smoothing: float = 0.2,
+        baseline_window: int = 500,
+        name: str = "llm",
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+        self.latency_smoothing = latency_smoothing
+        self.baseline_window = baseline_window
+        self.name = name
+
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+        self.smoothed_latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self.last_backoff = 0.0
+
+        self.started_at: Optional[float] = None
+        self.n_completed = 0
+        self.n_errors = 0
+        self.n_overloaded = 0
+        # (seconds since first request, new limit, reason)
+        self.limit_history: List[Tuple[float, int, str]] = [
+            (0.0, initial_limit, "start")
+        ]
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+
+    async def release(self, latency: float, error: Optional[BaseException] = None):
+        async with self.condition:
+            self.in_flight -= 1
+            self.n_completed += 1
+            self._update(latency, error)
+            # Wake only as many waiters as there are free slots. notify_all would
+            # wake every queued task on each completion, which with thousands
+            # queued makes the event loop itself the bottleneck
+            self.condition.notify(max(int(self.limit) - self.in_flight, 0))
+
+    async def __aenter__(self):
+        await self.acquire()
+        slot = {"start": time.monotonic(), "error": None}
+        slot["token"] = _current_slot.set(slot)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        slot = _current_slot.get()
+        _current_slot.reset(slot["token"])
+        await self.release(time.monotonic() - slot["start"], exc or slot["error"])
+        return False
+
+    def _elapsed(self) -> float:
+        return time.monotonic() - self.started_at if self.started_at else 0.0
+
+    def _set_limit(self, new_limit: float, reason: str):
+        new_limit = min(max(new_limit, self.min_limit), self.max_limit)
+        if int(new_limit) != int(self.limit):
+            self.limit_history.append((self._elapsed(), int(new_limit), reason))
+            logger.debug(
+                f"{self.name}: concurrency {int(self.limit)} -> {int(new_limit)} ({reason})"
+            )
+        self.limit = new_limit
+
+    def _backoff(self, started: float, reason: str):
+        # Requests sent before the last backoff were admitted under the old,
+        # higher limit, so their failures must not cut the limit again
+        if started >= self.last_backoff:
+            self.last_backoff = time.monotonic()
+            self._set_limit(self.limit * self.backoff_factor, reason)
+
+    def _update(self, latency: float, error: Optional[BaseException]):
+        started = time.monotonic() - latency
+        if error is not None:
+            self.n_errors += 1
+            if is_overload_error(error):
+                self.n_overloaded += 1
+                self._backoff(started, "overloaded")
+            # Other errors (e.g. validation failures) say nothing about load
+            return
+
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency
+        else:
+            self.smoothed_latency += self.latency_smoothing * (
+                latency - self.smoothed_latency
+            )
+        # The baseline is the average latency over about the last
+        # `baseline_window` completions (a plain running mean until then). An
+        # all-time minimum of the smoothed latency keeps falling with every
+        # unusually fast run, so with a wide latency spread ordinary requests
+        # end up over the tolerance and the limit is cut for no reason
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency += (latency - self.baseline_latency) / min(
+                self.n_completed, self.baseline_window
+            )
+
+        if self.smoothed_latency > self.latency_tolerance * self.baseline_latency:
+            self._backoff(started, "latency")
+        elif self.in_flight + 1 >= int(self.limit):
+            # Only grow when the current limit is actually being used
+            self._set_limit(self.limit + self.increase / self.limit, "healthy")
+
+    def requests_per_second(self) -> float:
+        elapsed = self._elapsed()
+        return self.n_completed / elapsed if elapsed > 0 else 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "completed": self.n_completed,
+            "errors": self.n_errors,
+            "overloaded": self.n_overloaded,
+            "requests_per_second": self.requests_per_second(),
+            "current_limit": int(self.limit),
+            "limit_history": self.limit_history,
+        }
+
+    def summary(self) -> str:
+        return (
+            f"{self.name}: {self.n_completed} requests at "
+            f"{self.requests_per_second():.1f} req/s, {self.n_errors} errors "
+            f"({self.n_overloaded} overload), concurrency limit "
+            f"{self.limit_history[0][1]} -> {int(self.limit)} "
+            f"after {len(self.limit_history) - 1} changes"
+        )
@@ -0,0 +1,134 @@
+import hashlib
+import re
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+from diskcache import Cache
+
+DEFAULT_EMBEDDING_CACHE_DIR = str(Path(__file__).parent / "embedding_cache")
+DEFAULT_BATCH_SIZE = 512
+
+# Takes a batch of texts and returns one vector per text
+Embedder = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row as float32, leaving all-zero rows as they are."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def openai_embedder(model: str = "text-embedding-3-small", client=None) -> Embedder:
+    """
+    Embed batches with the OpenAI embeddings endpoint. Reads OPENAI_API_KEY
+    from the environment when no client is given.
+    """
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        nonlocal client
+        if client is None:
+            from openai import OpenAI
+
+            client = OpenAI()
+        response = client.embeddings.create(input=texts, model=model)
+        return [item.embedding for item in response.data]
+
+    return embed
+
+
+def hashing_embedder(dimensions: int = 256) -> Embedder:
+    """
+    A deterministic local embedder: hashed bag of words, L2-normalized.
+
+    It needs no network or model weights, so tests and offline runs can use it
+    in place of an API model. It only captures word overlap.
+    """
+
+    def embed(texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in re.findall(r"\w+", text.lower()):
+                digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+                vectors[row, int.from_bytes(digest, "little") % dimensions] += 1.0
+        return normalize(vectors)
+
+    return embed
+
+
+class EmbeddingCache:
+    """
+    Caches embeddings on disk, keyed by model name and a hash of the text.
+
+    `embed` only sends texts that aren't cached yet, deduplicated and split
+    into batches of `batch_size`, so embedding the same texts again costs no
+    requests. Pass a distinct `model_name` for every embedder, including local
+    ones, so their vectors never mix.
+
+        cache = EmbeddingCache(openai_embedder(), "text-embedding-3-small")
+        vectors = cache.embed(["first text", "second text"])
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        model_name: str,
+        directory: str = DEFAULT_EMBEDDING_CACHE_DIR,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ):
+        self.embedder = embedder
+        self.model_name = model_name
+        self.cache = Cache(directory)
+        self.batch_size = batch_size
+        self.n_calls = 0
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embed `texts` and return a float32 matrix with one row per text.
+        """
+        texts = list(texts)
+        keys = [self.make_key(text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [self.cache.get(key) for key in keys]
+
+        missing = {}
+        for text, key, vector in zip(texts, keys, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(vector is None for vector in vectors)
+        self.misses += len(missing)
+
+        computed = {}
+        pending = list(missing.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start : start + self.batch_size]
+            self.n_calls += 1
+            embeddings = self.embedder([text for _, text in batch])
+            with self.cache.transact():
+                for (key, _), embedding in zip(batch, embeddings):
+                    vector = np.asarray(embedding, dtype=np.float32)
+                    self.cache.set(key, vector)
+                    computed[key] = vector
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(
+            [
+                vector if vector is not None else computed[key]
+                for key, vector in zip(keys, vectors)
+            ]
+        )
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "calls": self.n_calls,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,321 @@
+import asyncio
+import collections.abc
+import enum
+import math
+import random
+import time
+import types
+import typing
+from collections import Counter, deque
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from diskcache import Cache
+from openai import APITimeoutError, InternalServerError, RateLimitError
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from embedding_cache import hashing_embedder
+from llm_cache import get_validation_context, make_cache_key
+
+FAKE_REQUEST = httpx.Request("POST", "https://fake-llm.invalid/v1/chat/completions")
+
+# Takes the request kwargs (messages, model, ...) and returns the response
+Responder = Callable[[Dict[str, Any]], Any]
+
+
+class LatencyModel:
+    """
+    Log-normal request latency: `median` seconds, with `sigma` controlling the
+    tail (sigma=0 gives a fixed latency). `per_item` adds time for each item of
+    a create_iterable response, like output tokens would.
+    """
+
+    def __init__(self, median: float = 0.5, sigma: float = 0.5, per_item: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+        self.per_item = per_item
+
+    def sample(self, rng: random.Random, n_items: int = 1) -> float:
+        return self.median * math.exp(self.sigma * rng.gauss(0, 1)) + (
+            self.per_item * n_items
+        )
+
+
+def rate_limit_error() -> RateLimitError:
+    return RateLimitError(
+        "Rate limit reached (fake)",
+        response=httpx.Response(429, request=FAKE_REQUEST),
+        body=None,
+    )
+
+
+def server_error() -> InternalServerError:
+    return InternalServerError(
+        "The server had an error (fake)",
+        response=httpx.Response(500, request=FAKE_REQUEST),
+        body=None,
+    )
+
+
+def synthesize(
+    annotation: Any,
+    rng: random.Random,
+    context: Optional[Dict[str, Any]] = None,
+    name: str = "value",
+    n_items: Tuple[int, int] = (1, 3),
+) -> Any:
+    """
+    Build JSON-like data that validates against `annotation`.
+
+    Strings are short placeholders, except that fields whose name contains
+    "label" draw from `context["labels"]` when present, so label validators
+    (e.g. the classifiers' `validation_context={"labels": ...}`) accept them.
+    """
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    labels = (context or {}).get("labels") if "label" in name else None
+
+    if annotation is str:
+        return rng.choice(labels) if labels else f"{name} {rng.randrange(10**6)}"
+    if annotation is bool:
+        return rng.random() < 0.5
+    if annotation is int:
+        return rng.randint(0, 100)
+    if annotation is float:
+        return round(rng.random(), 4)
+    if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+        return rng.choice(list(annotation)).value
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return {
+            field_name: synthesize(field.annotation, rng, context, field_name, n_items)
+            for field_name, field in annotation.model_fields.items()
+        }
+    if origin is typing.Literal:
+        return rng.choice(args)
+    if origin is typing.Annotated:
+        return synthesize(args[0], rng, context, name, n_items)
+    if origin in (typing.Union, types.UnionType):
+        options = [arg for arg in args if arg is not type(None)]
+        return synthesize(options[0], rng, context, name, n_items) if options else None
+    if origin in (list, set, frozenset, tuple, collections.abc.Iterable):
+        item = args[0] if args else str
+        count = 1 if labels else rng.randint(*n_items)
+        return [synthesize(item, rng, context, name, n_items) for _ in range(count)]
+    if origin is dict:
+        return {}
+    return None
+
+
+class FakeLLM:
+    """
+    Offline stand-in for an instructor client, for running and benchmarking
+    the LLM pipelines without network access.
+
+        client = FakeLLM(latency=LatencyModel(median=0.8), rate_limit_rate=0.05)
+        client.chat.completions.create(model=..., response_model=..., messages=...)
+
+    Responses come from, in order:
+    1. the llm_cache directory `replay_directory`, so responses recorded by
+       `cached_client` replay exactly;
+    2. a `responders` entry for the response model;
+    3. data synthesized from the response model's schema.
+
+    Every request sleeps for a latency drawn from `latency`. It may fail with
+    openai's own RateLimitError (429), InternalServerError (500) or
+    APITimeoutError, at the given rates, or with a 429 whenever more than
+    `requests_per_minute` requests arrive within a minute.
+
+    Responses and injected failures are seeded by `seed` and the request itself,
+    so runs are reproducible no matter how concurrent requests interleave. A
+    retried request gets a fresh draw.
+    """
+
+    def __init__(
+        self,
+        latency: Optional[LatencyModel] = None,
+        rate_limit_rate: float = 0.0,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout: float = 10.0,
+        requests_per_minute: Optional[int] = None,
+        replay_directory: Optional[str] = None,
+        responders: Optional[Dict[Any, Responder]] = None,
+        n_items: Tuple[int, int] = (1, 3),
+        embedding_dimensions: int = 256,
+        seed: int = 0,
+    ):
+        self.latency = latency or LatencyModel()
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.requests_per_minute = requests_per_minute
+        self.replay = Cache(replay_directory) if replay_directory else None
+        self.responders = responders or {}
+        self.n_items = n_items
+        self.embedder = hashing_embedder(embedding_dimensions)
+        self.seed = seed
+
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(
+                create=self.create, create_iterable=self.create_iterable
+            )
+        )
+        self.embeddings = SimpleNamespace(create=self.create_embeddings)
+
+        self.attempts: Counter = Counter()
+        self.request_times: deque = deque()
+        self.n_calls = 0
+        self.n_replayed = 0
+        self.n_synthesized = 0
+        self.n_rate_limited = 0
+        self.n_errors = 0
+        self.n_timeouts = 0
+        self.latencies: List[float] = []
+
+    def _plan(self, key: str, n_items: int = 1) -> Tuple[float, Optional[Exception]]:
+        """Latency and injected failure (if any) for one attempt at a request."""
+        attempt = self.attempts[key]
+        self.attempts[key] += 1
+        rng = random.Random(f"{self.seed}:{key}:{attempt}")
+        self.n_calls += 1
+
+        if self.requests_per_minute is not None:
+            now = time.monotonic()
+            while self.request_times and now - self.request_times[0] > 60:
+                self.request_times.popleft()
+            if len(self.request_times) >= self.requests_per_minute:
+                self.n_rate_limited += 1
+                return 0.01, rate_limit_error()
+            self.request_times.append(now)
+
+        latency = self.latency.sample(rng, n_items)
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            self.n_rate_limited += 1
+            return min(latency, 0.05), rate_limit_error()
+        roll -= self.rate_limit_rate
+        if roll < self.error_rate:
+            self.n_errors += 1
+            return latency, server_error()
+        roll -= self.error_rate
+        if roll < self.timeout_rate:
+            self.n_timeouts += 1
+            return self.timeout, APITimeoutError(request=FAKE_REQUEST)
+        self.latencies.append(latency)
+        return latency, None
+
+    def _respond(self, kind: str, response_model: Any, kwargs: Dict[str, Any]):
+        key = make_cache_key(kind, response_model, kwargs)
+        adapter_model = (
+            List[response_model] if kind == "create_iterable" else response_model
+        )
+        context = get_validation_context(kwargs)
+
+        if self.replay is not None:
+            cached = self.replay.get(key)
+            if cached is not None:
+                self.n_replayed += 1
+                return key, TypeAdapter(adapter_model).validate_python(
+                    cached, context=context
+                )
+
+        self.n_synthesized += 1
+        if response_model in self.responders:
+            return key, self.responders[response_model](kwargs)
+
+        rng = random.Random(f"{self.seed}:{key}")
+        adapter = TypeAdapter(adapter_model)
+        for _ in range(3):
+            data = synthesize(adapter_model, rng, context, n_items=self.n_items)
+            try:
+                return key, adapter.validate_python(data, context=context)
+            except ValidationError as e:
+                error = e
+        raise error
+
+    def _prepare(self, kind: str, response_model: Any, kwargs: Dict[str, Any]):
+        key, response = self._respond(kind, response_model, kwargs)
+        n_items = len(response) if kind == "create_iterable" else 1
+        latency, error = self._plan(key, n_items)
+        return latency, error, response
+
+    def create(self, response_model: Any, **kwargs):
+        latency, error, response = self._prepare("create", response_model, kwargs)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return response
+
+    def create_iterable(self, response_model: Any, **kwargs) -> List[Any]:
+        latency, error, response = self._prepare(
+            "create_iterable", response_model, kwargs
+        )
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return response
+
+    def _embedding_response(self, input: Any):
+        texts = [input] if isinstance(input, str) else list(input)
+        return SimpleNamespace(
+            data=[
+                SimpleNamespace(index=i, embedding=vector.tolist())
+                for i, vector in enumerate(self.embedder(texts))
+            ]
+        )
+
+    def create_embeddings(self, input: Any, model: str, **kwargs):
+        latency, error = self._plan(f"embeddings:{model}:{input}")
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return self._embedding_response(input)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            "calls": self.n_calls,
+            "replayed": self.n_replayed,
+            "synthesized": self.n_synthesized,
+            "rate_limited": self.n_rate_limited,
+            "errors": self.n_errors,
+            "timeouts": self.n_timeouts,
+            "p50_latency": latencies[len(latencies) // 2] if latencies else 0.0,
+            "p95_latency": (
+                latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+            ),
+        }
+
+
+class AsyncFakeLLM(FakeLLM):
+    """
+    FakeLLM for async pipelines. Latency is awaited, so concurrency and
+    throughput behave as they would against the API, and `create_iterable`
+    returns an async iterator like instructor's.
+    """
+
+    async def create(self, response_model: Any, **kwargs):
+        latency, error, response = self._prepare("create", response_model, kwargs)
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return response
+
+    async def create_iterable(self, response_model: Any, **kwargs):
+        latency, error, response = self._prepare(
+            "create_iterable", response_model, kwargs
+        )
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        for item in response:
+            yield item
+
+    async def create_embeddings(self, input: Any, model: str, **kwargs):
+        latency, error = self._plan(f"embeddings:{model}:{input}")
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return self._embedding_response(input)
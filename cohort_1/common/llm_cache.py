@@ -0,0 +1,158 @@
+import hashlib
+import json
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Union
+
+import instructor
+from diskcache import Cache
+from pydantic import TypeAdapter
+
+DEFAULT_LLM_CACHE_DIR = str(Path(__file__).parent / "llm_cache")
+DEFAULT_SIZE_LIMIT = 2**30  # 1 GiB, least recently used entries are evicted first
+
+
+def schema_hash(response_model: Any) -> str:
+    """
+    Hash the JSON schema of a response model, so changing a field, description
+    or validator-visible type invalidates cached responses.
+    """
+    schema = TypeAdapter(response_model).json_schema()
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+
+
+def get_validation_context(kwargs: Dict[str, Any]) -> Any:
+    return kwargs.get("validation_context") or kwargs.get("context")
+
+
+def make_cache_key(kind: str, response_model: Any, kwargs: Dict[str, Any]) -> str:
+    """
+    Key for one request: the method ("create" or "create_iterable"), the schema
+    of `response_model` and every other request parameter.
+    """
+    payload = json.dumps(
+        {
+            "kind": kind,
+            "response_model": schema_hash(response_model),
+            "request": kwargs,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CachedInstructor:
+    """
+    Wraps an instructor client and caches structured responses on disk.
+
+    Responses are keyed on model, messages, every other request parameter and
+    the JSON schema of `response_model`. On a hit the stored JSON is validated
+    again with `response_model` (and any validation context), so callers get
+    the same pydantic objects they would get from the API.
+
+        client = CachedInstructor(instructor.from_openai(OpenAI()))
+        client.chat.completions.create(model=..., response_model=..., messages=...)
+    """
+
+    def __init__(
+        self,
+        client: instructor.Instructor,
+        directory: str = DEFAULT_LLM_CACHE_DIR,
+        size_limit: int = DEFAULT_SIZE_LIMIT,
+    ):
+        self.client = client
+        self.cache = Cache(
+            directory,
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+        )
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(
+                create=self.create, create_iterable=self.create_iterable
+            )
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+    def make_key(self, kind: str, response_model: Any, kwargs: Dict[str, Any]) -> str:
+        return make_cache_key(kind, response_model, kwargs)
+
+    def lookup(self, key: str, response_model: Any, kwargs: Dict[str, Any]):
+        cached = self.cache.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return TypeAdapter(response_model).validate_python(
+            cached, context=get_validation_context(kwargs)
+        )
+
+    def store(self, key: str, response_model: Any, result: Any):
+        self.cache.set(
+            key, TypeAdapter(response_model).dump_python(result, mode="json")
+        )
+
+    def create(self, response_model: Any, **kwargs):
+        key = self.make_key("create", response_model, kwargs)
+        cached = self.lookup(key, response_model, kwargs)
+        if cached is not None:
+            return cached
+        result = self.client.create(response_model=response_model, **kwargs)
+        self.store(key, response_model, result)
+        return result
+
+    def create_iterable(self, response_model: Any, **kwargs) -> List[Any]:
+        key = self.make_key("create_iterable", response_model, kwargs)
+        cached = self.lookup(key, List[response_model], kwargs)
+        if cached is not None:
+            return cached
+        results = list(
+            self.client.create_iterable(response_model=response_model, **kwargs)
+        )
+        self.store(key, List[response_model], results)
+        return results
+
+
+class AsyncCachedInstructor(CachedInstructor):
+    """
+    CachedInstructor for async instructor clients. `create_iterable` returns an
+    async iterator, like instructor's.
+    """
+
+    async def create(self, response_model: Any, **kwargs):
+        key = self.make_key("create", response_model, kwargs)
+        cached = self.lookup(key, response_model, kwargs)
+        if cached is not None:
+            return cached
+        result = await self.client.create(response_model=response_model, **kwargs)
+        self.store(key, response_model, result)
+        return result
+
+    async def create_iterable(self, response_model: Any, **kwargs):
+        key = self.make_key("create_iterable", response_model, kwargs)
+        results = self.lookup(key, List[response_model], kwargs)
+        if results is None:
+            results = [
+                item
+                async for item in self.client.create_iterable(
+                    response_model=response_model, **kwargs
+                )
+            ]
+            self.store(key, List[response_model], results)
+        for item in results:
+            yield item
+
+
+def cached_client(
+    client: Union[instructor.Instructor, instructor.AsyncInstructor], **kwargs
+) -> CachedInstructor:
+    """
+    Wrap a sync or async instructor client with the matching caching wrapper.
+    """
+    if isinstance(client, instructor.AsyncInstructor):
+        return AsyncCachedInstructor(client, **kwargs)
+    return CachedInstructor(client, **kwargs)
@@ -0,0 +1,94 @@
+import hashlib
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import lancedb
+from diskcache import Cache
+
+# Anchored to this file so week1 and week5 scripts share one store regardless of cwd
+DEFAULT_CANDIDATE_CACHE_DIR = str(Path(__file__).parent / "first_stage_cache")
+DEFAULT_COLUMNS = ("id", "review")
+
+
+class CandidateStore:
+    """
+    Persistent store of first-stage (vector search) candidates.
+
+    Entries are keyed by query text, table name, table version, limit and the
+    selected columns, so adding rows to the table (which bumps its version)
+    invalidates old candidates automatically.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CANDIDATE_CACHE_DIR):
+        self.cache = Cache(directory)
+
+    @staticmethod
+    def make_key(
+        query: str,
+        table: lancedb.table.LanceTable,
+        limit: int,
+        columns: Sequence[str] = DEFAULT_COLUMNS,
+    ) -> str:
+        payload = json.dumps(
+            {
+                "query": query,
+                "table": getattr(table, "name", None),
+                "version": getattr(table, "version", None),
+                "limit": limit,
+                "columns": list(columns),
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(
+        self,
+        table: lancedb.table.LanceTable,
+        query: str,
+        limit: int,
+        columns: Sequence[str] = DEFAULT_COLUMNS,
+    ) -> List[Dict[str, Any]]:
+        """
+        Return the first-stage candidates for a query, searching only on a cache miss.
+
+        Args:
+            table (lancedb.table.LanceTable): The table to search.
+            query (str): The query text.
+            limit (int): Number of candidates to retrieve.
+            columns (Sequence[str], optional): Columns to keep for each candidate.
+
+        Returns:
+            List[Dict[str, Any]]: Candidate rows in first-stage order.
+        """
+        key = self.make_key(query, table, limit, columns)
+        candidates = self.cache.get(key)
+        if candidates is None:
+            candidates = (
+                table.search(query).select(list(columns)).limit(limit).to_list()
+            )
+            self.cache.set(key, candidates)
+        return candidates
+
+    def get_many(
+        self,
+        table: lancedb.table.LanceTable,
+        queries: List[str],
+        limit: int,
+        columns: Sequence[str] = DEFAULT_COLUMNS,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Return first-stage candidates for each query, preserving input order.
+        """
+        return [self.get(table, query, limit, columns) for query in queries]
+
+
+@lru_cache(maxsize=None)
+def get_candidate_store(
+    directory: str = DEFAULT_CANDIDATE_CACHE_DIR,
+) -> CandidateStore:
+    """
+    Return a process-wide CandidateStore for the given directory.
+    """
+    return CandidateStore(directory)
@@ -0,0 +1,130 @@
+"""
+Local stand-in for the Cohere async rerank endpoint.
+
+It scores documents by word overlap with the query, sleeps for a configurable
+latency, and enforces its own per-minute request and document limits by
+raising 429 errors, so rerank throughput and backoff behaviour can be
+benchmarked offline:
+
+    python fake_rerank.py
+"""
+
+import asyncio
+import random
+import tempfile
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import List, Optional
+
+from rerank_scheduler import AsyncRerankScheduler
+from rerank_store import RerankStore
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+class FakeRerankClient:
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = 600,
+        documents_per_minute: Optional[float] = None,
+        latency: float = 0.05,
+        latency_jitter: float = 0.02,
+        seed: int = 0,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.documents_per_minute = documents_per_minute
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.random = random.Random(seed)
+        # (timestamp, n_documents) of accepted calls in the last minute
+        self.window = deque()
+        self.n_accepted = 0
+        self.n_rejected = 0
+
+    def _check_limits(self, n_documents: int):
+        now = time.monotonic()
+        while self.window and now - self.window[0][0] > 60:
+            self.window.popleft()
+        too_many_requests = (
+            self.requests_per_minute is not None
+            and len(self.window) + 1 > self.requests_per_minute
+        )
+        too_many_documents = (
+            self.documents_per_minute is not None
+            and sum(n for _, n in self.window) + n_documents > self.documents_per_minute
+        )
+        if too_many_requests or too_many_documents:
+            self.n_rejected += 1
+            raise FakeRateLimitError("429: rate limit exceeded")
+        self.window.append((now, n_documents))
+        self.n_accepted += 1
+
+    @staticmethod
+    def _score(query: str, document: str) -> float:
+        query_words = set(query.lower().split())
+        document_words = set(document.lower().split())
+        if not query_words or not document_words:
+            return 0.0
+        return len(query_words & document_words) / len(query_words | document_words)
+
+    async def rerank(
+        self, query: str, documents: List[str], top_n: int, model: str
+    ) -> SimpleNamespace:
+        self._check_limits(len(documents))
+        await asyncio.sleep(
+            max(0.0, self.random.gauss(self.latency, self.latency_jitter))
+        )
+        scores = [self._score(query, document) for document in documents]
+        order = sorted(range(len(documents)), key=lambda i: -scores[i])[:top_n]
+        return SimpleNamespace(
+            results=[SimpleNamespace(index=i, relevance_score=scores[i]) for i in order]
+        )
+
+
+async def benchmark(
+    n_queries: int = 500,
+    n_documents: int = 40,
+    requests_per_minute: float = 6000,
+    documents_per_minute: Optional[float] = None,
+) -> dict:
+    """
+    Rerank n_queries synthetic queries through the scheduler against the fake
+    endpoint and report achieved throughput.
+    """
+    client = FakeRerankClient(
+        requests_per_minute=requests_per_minute,
+        documents_per_minute=documents_per_minute,
+    )
+    scheduler = AsyncRerankScheduler(
+        client=client,
+        requests_per_minute=requests_per_minute,
+        documents_per_minute=documents_per_minute,
+        store=RerankStore(tempfile.mkdtemp()),
+    )
+    documents = [
+        f"review {i} about battery life and weight" for i in range(n_documents)
+    ]
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            scheduler.rerank(f"question {i} about battery", documents, "fake-rerank")
+            for i in range(n_queries)
+        ]
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        "queries": n_queries,
+        "seconds": elapsed,
+        "requests_per_second": n_queries / elapsed,
+        "calls": scheduler.n_calls,
+        "retries": scheduler.n_retries,
+        "rate_limited": client.n_rejected,
+    }
+
+
+if __name__ == "__main__":
+    print(asyncio.run(benchmark()))
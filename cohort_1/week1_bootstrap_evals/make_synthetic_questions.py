@@ -1,23 +1,24 @@
 import json
+import os
+import sys
 import asyncio
-from typing import List
+from typing import List, Set
 import logging
 import instructor
 from openai import AsyncOpenAI
 from pydantic import BaseModel
 import lancedb
 
+sys.path.append("../common")
+from adaptive_concurrency import AdaptiveConcurrencyLimiter
+from llm_cache import cached_client
 
-db = lancedb.connect("./lancedb")
-reviews_table = db.open_table("reviews")
-sample_reviews = reviews_table.to_pandas()
-sample_reviews.review
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Patch the AsyncOpenAI client
-client = instructor.from_openai(AsyncOpenAI())
+# Patch the AsyncOpenAI client, caching responses so reruns don't call the LLM again
+client = cached_client(instructor.from_openai(AsyncOpenAI()))
 
 
 class QuestionAnswer(BaseModel):
@@ -70,17 +71,19 @@ async def generate_evals(
             async for pair in pairs
         ]
     except Exception as e:
+        # Raised rather than returning [], so a failed chunk isn't mistaken for
+        # one with no questions and is retried on resume
         logger.error(f"Error generating evals: {str(e)}")
-        return []
+        raise
 
 
 async def process_chunk(
     chunk: TextChunk,
     n_questions: int,
     example_questions: List[str],
-    semaphore: asyncio.Semaphore,
+    limiter: AdaptiveConcurrencyLimiter,
 ) -> List[ChunkEval]:
-    async with semaphore:
+    async with limiter:
         try:
             return await generate_evals(chunk, n_questions, example_questions)
         except Exception as e:
@@ -94,12 +97,14 @@ async def create_synthetic_dataset(
     example_questions: List[str],
     max_concurrency: int = 10,
 ) -> List[ChunkEval]:
-    semaphore = asyncio.Semaphore(max_concurrency)
+    # max_concurrency is the starting point; the limiter adapts it to provider load
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=max_concurrency)
     tasks = [
-        process_chunk(chunk, n_questions, example_questions, semaphore)
+        process_chunk(chunk, n_questions, example_questions, limiter)
         for chunk in chunks
     ]
     results = await asyncio.gather(*tasks, return_exceptions=True)
+    logger.info(limiter.summary())
 
     dataset = []
     for result in results:
@@ -113,11 +118,150 @@ async def create_synthetic_dataset(
     return dataset
 
 
+def load_sample_reviews(db_path: str = "./lancedb"):
+    """
+    Load the product reviews to make chunks from, as a DataFrame.
+    """
+    db = lancedb.connect(db_path)
+    return db.open_table("reviews").to_pandas()
+
+
 def save_dataset(dataset: List[ChunkEval], filename: str):
     with open(filename, "w") as f:
         json.dump([chunk_eval.dict() for chunk_eval in dataset], f, indent=2)
 
 
+def done_filename(filename: str) -> str:
+    """The file listing the chunks whose evals are all written to `filename`."""
+    return f"{filename}.done"
+
+
+def read_complete_lines(filename: str) -> List[bytes]:
+    """
+    Return the newline-terminated lines of a file. A trailing partial line
+    (left by a crash mid-write) is truncated away so appending can resume.
+    """
+    if not os.path.exists(filename):
+        return []
+
+    lines = []
+    complete_bytes = 0
+    with open(filename, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            complete_bytes += len(line)
+            lines.append(line)
+
+    if complete_bytes != os.path.getsize(filename):
+        logger.warning(f"Truncating partial last line of {filename}")
+        with open(filename, "rb+") as f:
+            f.truncate(complete_bytes)
+    return lines
+
+
+def completed_chunk_ids(filename: str) -> Set[str]:
+    """
+    Return the ids of chunks that were completely written to a JSONL dataset
+    file, including chunks that yielded no evals.
+
+    A chunk only counts as done once its id is in the done file, which is
+    written after all of the chunk's lines. Lines of chunks that were cut off
+    by a crash are removed, so those chunks are generated again from scratch.
+    Files written before the done file existed count every chunk as done.
+    """
+    lines = [line for line in read_complete_lines(filename) if line.strip()]
+    if lines and not os.path.exists(done_filename(filename)):
+        with open(done_filename(filename), "w") as f:
+            for chunk_id in dict.fromkeys(
+                json.loads(line)["chunk_id"] for line in lines
+            ):
+                f.write(json.dumps(chunk_id) + "\n")
+
+    chunk_ids = {
+        json.loads(line) for line in read_complete_lines(done_filename(filename))
+    }
+    kept = [line for line in lines if json.loads(line)["chunk_id"] in chunk_ids]
+    if len(kept) != len(lines):
+        logger.warning(
+            f"Removing {len(lines) - len(kept)} evals of unfinished chunks from {filename}"
+        )
+        with open(f"{filename}.tmp", "wb") as f:
+            f.writelines(kept)
+        os.replace(f"{filename}.tmp", filename)
+    return chunk_ids
+
+
+def load_dataset_jsonl(filename: str) -> List[ChunkEval]:
+    with open(filename, "r") as f:
+        return [ChunkEval.model_validate_json(line) for line in f if line.strip()]
+
+
+async def stream_synthetic_dataset(
+    chunks: List[TextChunk],
+    n_questions: int,
+    example_questions: List[str],
+    filename: str,
+    max_concurrency: int = 10,
+    resume: bool = True,
+) -> int:
+    """
+    Generate evals like create_synthetic_dataset, but append each chunk's
+    ChunkEvals to a JSONL file as soon as that chunk finishes.
+
+    Nothing is held in memory beyond in-flight chunks, and a crash only loses
+    the chunks that were running. Each chunk's id is added to the done file
+    (see completed_chunk_ids) once all its evals are written, even when there
+    are none. With resume=True, finished chunks are skipped and chunks that
+    failed are retried; otherwise both files are overwritten.
+
+    Returns:
+        int: Number of ChunkEvals written by this run.
+    """
+    if resume:
+        done = completed_chunk_ids(filename)
+    else:
+        done = set()
+        open(filename, "w").close()
+        open(done_filename(filename), "w").close()
+
+    pending = [chunk for chunk in chunks if chunk.id not in done]
+    if done:
+        logger.info(f"Resuming: skipping {len(chunks) - len(pending)} finished chunks")
+
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=max_concurrency)
+
+    async def process_pending(chunk: TextChunk):
+        return (
+            await process_chunk(chunk, n_questions, example_questions, limiter),
+            chunk.id,
+        )
+
+    tasks = [process_pending(chunk) for chunk in pending]
+
+    n_written = 0
+    with open(filename, "a") as f, open(done_filename(filename), "a") as done_file:
+        for next_result in asyncio.as_completed(tasks):
+            try:
+                chunk_evals, chunk_id = await next_result
+            except ChunkProcessingError as e:
+                logger.error(str(e))
+                continue
+            f.write(
+                "".join(
+                    f"{chunk_eval.model_dump_json()}\n" for chunk_eval in chunk_evals
+                )
+            )
+            f.flush()
+            # Only now is the chunk done; a crash before this line reruns it
+            done_file.write(json.dumps(chunk_id) + "\n")
+            done_file.flush()
+            n_written += len(chunk_evals)
+
+    logger.info(limiter.summary())
+    return n_written
+
+
 async def main():
     # Sample text chunks (replace with your actual data)
 
@@ -144,16 +288,17 @@ async def main():
         "What does the reviewer think could be improved?",
     ]
     try:
-        # Generate the dataset
-        synthetic_dataset = await create_synthetic_dataset(
-            sample_chunks, n_questions, example_questions
+        # Generate the dataset, appending to the file as chunks finish.
+        # Rerunning after a crash only generates unfinished or failed chunks.
+        n_generated = await stream_synthetic_dataset(
+            sample_chunks,
+            n_questions,
+            example_questions,
+            "synthetic_eval_questions.jsonl",
         )
 
-        # Save the dataset
-        save_dataset(synthetic_dataset, "synthetic_eval_questions.json")
-
-        logger.info(f"Generated {len(synthetic_dataset)} ChunkEvals.")
-        logger.info("Dataset saved as 'synthetic_eval_questions.json'")
+        logger.info(f"Generated {n_generated} ChunkEvals.")
+        logger.info("Dataset saved as 'synthetic_eval_questions.jsonl'")
     except Exception as e:
         logger.error(f"An error occurred during dataset creation: {str(e)}")
 
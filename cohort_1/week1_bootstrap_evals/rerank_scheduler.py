@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import random
+import time
+from typing import List, Optional, Tuple
+
+from rerank_store import RerankStore, get_cohere_async_client, get_rerank_store
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Async token bucket that refills continuously at `rate_per_minute`.
+
+    Callers wait in FIFO order. A request larger than the bucket capacity is
+    let through once the bucket is full and leaves the bucket in debt, so
+    oversized requests are slowed down rather than blocked forever.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        # Default burst is one second of budget, but always at least one token
+        self.capacity = capacity if capacity is not None else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n: float = 1):
+        async with self.lock:
+            needed = min(n, self.capacity)
+            self._refill()
+            while self.tokens < needed:
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= n
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+class AsyncRerankScheduler:
+    """
+    Schedules rerank API calls under request and document rate limits.
+
+    Each call first checks the shared RerankStore, then waits for budget in
+    the request bucket (one token per call) and the document bucket (one token
+    per candidate), and retries 429s, 5xxs and timeouts with full-jitter
+    exponential backoff.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        requests_per_minute: Optional[float] = 1000,
+        documents_per_minute: Optional[float] = None,
+        max_in_flight: int = 32,
+        max_retries: int = 6,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        timeout: float = 60.0,
+        store: Optional[RerankStore] = None,
+    ):
+        self.client = client if client is not None else get_cohere_async_client()
+        self.request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.document_bucket = (
+            TokenBucket(documents_per_minute) if documents_per_minute else None
+        )
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.store = store if store is not None else get_rerank_store()
+        self.n_calls = 0
+        self.n_retries = 0
+        self.n_rate_limited = 0
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def rerank(
+        self, query: str, documents: List[str], model: str
+    ) -> List[Tuple[int, float]]:
+        """
+        Return the full reranked ordering of documents, calling the API only on a miss.
+
+        Args:
+            query (str): The query to rerank against.
+            documents (List[str]): The first-stage candidate texts.
+            model (str): The rerank model.
+
+        Returns:
+            List[Tuple[int, float]]: (index into documents, relevance score), best first.
+        """
+        ordering = self.store.get_cached(query, documents, model)
+        if ordering is not None:
+            return ordering
+
+        for attempt in range(self.max_retries + 1):
+            if self.request_bucket:
+                await self.request_bucket.acquire(1)
+            if self.document_bucket:
+                await self.document_bucket.acquire(len(documents))
+            try:
+                async with self.in_flight:
+                    self.n_calls += 1
+                    reranked = await asyncio.wait_for(
+                        self.client.rerank(
+                            query=query,
+                            documents=documents,
+                            top_n=len(documents),
+                            model=model,
+                        ),
+                        timeout=self.timeout,
+                    )
+                return self.store.save(query, documents, model, reranked)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                if getattr(e, "status_code", None) == 429:
+                    self.n_rate_limited += 1
+                self.n_retries += 1
+                delay = self.backoff(attempt)
+                logger.warning(
+                    f"Rerank attempt {attempt + 1} failed ({e!r}), retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
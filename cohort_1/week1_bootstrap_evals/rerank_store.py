@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import cohere
+from diskcache import Cache
+
+DEFAULT_RERANK_CACHE_DIR = str(Path(__file__).parent / "rerank_cache")
+
+
+@lru_cache(maxsize=None)
+def get_cohere_client() -> cohere.Client:
+    """
+    Return one process-wide Cohere client so its HTTP connection pool is reused
+    across threads instead of being rebuilt for every request.
+    """
+    return cohere.Client(os.environ["COHERE_API_KEY"])
+
+
+@lru_cache(maxsize=None)
+def get_cohere_async_client() -> cohere.AsyncClient:
+    """
+    Return one process-wide async Cohere client for the asyncio rerank scheduler.
+    """
+    return cohere.AsyncClient(os.environ["COHERE_API_KEY"])
+
+
+def hash_candidates(documents: List[str]) -> str:
+    return hashlib.sha256(json.dumps(documents).encode()).hexdigest()
+
+
+class RerankStore:
+    """
+    Persistent store of full reranked orderings.
+
+    Each entry holds the (candidate index, relevance score) of every candidate,
+    best first, keyed by query, candidate set hash and model. Any top-k with
+    k <= len(documents) is a slice of that ordering, so changing k never needs
+    another API call.
+    """
+
+    def __init__(self, directory: str = DEFAULT_RERANK_CACHE_DIR):
+        self.cache = Cache(directory)
+
+    @staticmethod
+    def make_key(query: str, documents: List[str], model: str) -> str:
+        payload = json.dumps(
+            {
+                "query": query,
+                "candidates": hash_candidates(documents),
+                "model": model,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def rerank(
+        self, query: str, documents: List[str], model: str
+    ) -> List[Tuple[int, float]]:
+        """
+        Return the full reranked ordering of documents, calling Cohere only on a miss.
+
+        Args:
+            query (str): The query to rerank against.
+            documents (List[str]): The first-stage candidate texts.
+            model (str): The Cohere rerank model.
+
+        Returns:
+            List[Tuple[int, float]]: (index into documents, relevance score), best first.
+        """
+        ordering = self.get_cached(query, documents, model)
+        if ordering is None:
+            reranked = get_cohere_client().rerank(
+                query=query,
+                documents=documents,
+                top_n=len(documents),
+                model=model,
+            )
+            ordering = self.save(query, documents, model, reranked)
+        return ordering
+
+    def get_cached(
+        self, query: str, documents: List[str], model: str
+    ) -> Optional[List[Tuple[int, float]]]:
+        return self.cache.get(self.make_key(query, documents, model))
+
+    def save(
+        self, query: str, documents: List[str], model: str, reranked
+    ) -> List[Tuple[int, float]]:
+        """
+        Store a full rerank API response and return it as an ordering.
+        """
+        ordering = [(r.index, r.relevance_score) for r in reranked.results]
+        self.cache.set(self.make_key(query, documents, model), ordering)
+        return ordering
+
+    def top_k(
+        self, query: str, documents: List[str], k: int, model: str
+    ) -> List[Tuple[int, float]]:
+        return self.rerank(query, documents, model)[:k]
+
+
+@lru_cache(maxsize=None)
+def get_rerank_store(directory: str = DEFAULT_RERANK_CACHE_DIR) -> RerankStore:
+    """
+    Return a process-wide RerankStore for the given directory.
+    """
+    return RerankStore(directory)
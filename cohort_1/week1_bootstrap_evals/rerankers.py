@@ -0,0 +1,97 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Protocol, Tuple
+
+from rerank_store import RerankStore, get_rerank_store
+
+# (index into the candidate list, relevance score), best first
+Ordering = List[Tuple[int, float]]
+
+
+class Reranker(Protocol):
+    name: str
+
+    def rerank(self, query: str, documents: List[str]) -> Ordering: ...
+
+    def rerank_many(
+        self, queries: List[str], documents: List[List[str]]
+    ) -> List[Ordering]: ...
+
+
+class CohereReranker:
+    """
+    Reranks through the Cohere API, one request per query, cached in the RerankStore.
+    """
+
+    def __init__(
+        self,
+        model: str = "rerank-english-v3.0",
+        store: Optional[RerankStore] = None,
+        max_workers: Optional[int] = None,
+    ):
+        self.model = model
+        self.name = f"cohere/{model}"
+        self.store = store if store is not None else get_rerank_store()
+        self.max_workers = max_workers
+
+    def rerank(self, query: str, documents: List[str]) -> Ordering:
+        return self.store.rerank(query, documents, self.model)
+
+    def rerank_many(
+        self, queries: List[str], documents: List[List[str]]
+    ) -> List[Ordering]:
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            return list(executor.map(self.rerank, queries, documents))
+
+
+class CrossEncoderReranker:
+    """
+    Reranks locally with a sentence-transformers CrossEncoder, such as the
+    `./fine_tuned_reranker` produced by week5_fine_tuning/finetune_sbert.py.
+
+    rerank_many flattens the (query, passage) pairs of every query into shared
+    predict batches, so a whole eval set costs a few large forward passes.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        batch_size: int = 256,
+        num_threads: Optional[int] = 4,
+    ):
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        # Cap intra-op threads so several rerankers (or a thread pool) don't oversubscribe the CPU
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.model = CrossEncoder(model_path)
+        self.name = f"cross-encoder/{model_path}"
+        self.batch_size = batch_size
+
+    def rerank(self, query: str, documents: List[str]) -> Ordering:
+        return self.rerank_many([query], [documents])[0]
+
+    def rerank_many(
+        self, queries: List[str], documents: List[List[str]]
+    ) -> List[Ordering]:
+        pairs = [
+            [query, document]
+            for query, candidates in zip(queries, documents)
+            for document in candidates
+        ]
+        scores = np.asarray(
+            self.model.predict(
+                pairs, batch_size=self.batch_size, show_progress_bar=False
+            )
+        )
+        if scores.ndim > 1:
+            scores = scores[:, 0]
+
+        orderings = []
+        offsets = np.cumsum([0] + [len(candidates) for candidates in documents])
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            query_scores = scores[start:end]
+            order = np.argsort(-query_scores, kind="stable")
+            orderings.append([(int(i), float(query_scores[i])) for i in order])
+        return orderings
@@ -0,0 +1,126 @@
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def hit_matrix_from_lists(hits: List[List[bool]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack ragged per-query hit lists into a padded hit matrix.
+
+    Args:
+        hits (List[List[bool]]): For each query, whether each retrieved result was relevant.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: An (n_queries x max_k) bool matrix and the
+            number of results actually retrieved for each query.
+    """
+    n_retrieved = np.fromiter((len(h) for h in hits), dtype=np.int64, count=len(hits))
+    max_k = int(n_retrieved.max(initial=0))
+    matrix = np.zeros((len(hits), max_k), dtype=bool)
+    matrix[np.arange(max_k) < n_retrieved[:, None]] = np.fromiter(
+        (hit for h in hits for hit in h), dtype=bool, count=int(n_retrieved.sum())
+    )
+    return matrix, n_retrieved
+
+
+def hit_matrix_from_ranks(ranks: Sequence[float], max_k: int) -> np.ndarray:
+    """
+    Build a hit matrix from the 1-based rank of the single relevant result per query.
+
+    Args:
+        ranks (Sequence[float]): Rank of the relevant result, or inf if it was not retrieved.
+        max_k (int): Number of columns (retrieval depth) of the matrix.
+
+    Returns:
+        np.ndarray: An (n_queries x max_k) bool matrix.
+    """
+    ranks = np.asarray(ranks, dtype=float)
+    return np.arange(1, max_k + 1) == ranks[:, None]
+
+
+def compute_retrieval_metrics(
+    hits: np.ndarray,
+    k_values: List[int],
+    n_relevant: Optional[np.ndarray] = None,
+    n_retrieved: Optional[np.ndarray] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Dict[int, Dict[str, float]]:
+    """
+    Compute precision, recall, MRR, NDCG and hit rate at every k in one pass.
+
+    Rows are processed in chunks so memory stays flat for millions of queries.
+
+    Args:
+        hits (np.ndarray): (n_queries x max_k) matrix, truthy where the result at
+            that position is relevant.
+        k_values (List[int]): Cutoffs to report. Cutoffs beyond max_k are clipped.
+        n_relevant (np.ndarray, optional): Number of relevant documents per query.
+            Defaults to 1, i.e. one target chunk per question.
+        n_retrieved (np.ndarray, optional): Number of results actually returned per
+            query, for padded rows. Defaults to max_k.
+        chunk_size (int, optional): Number of rows to process at a time.
+
+    Returns:
+        Dict[int, Dict[str, float]]: For each k, a dict of metric name to value.
+    """
+    hits = np.asarray(hits, dtype=bool)
+    n_queries, max_k = hits.shape
+    if n_relevant is None:
+        n_relevant = np.ones(n_queries, dtype=np.int64)
+    if n_retrieved is None:
+        n_retrieved = np.full(n_queries, max_k, dtype=np.int64)
+    n_relevant = np.asarray(n_relevant)
+    n_retrieved = np.asarray(n_retrieved)
+
+    cutoffs = np.clip(np.asarray(k_values, dtype=np.int64), 0, max_k)
+    discounts = 1.0 / np.log2(np.arange(2, max_k + 2))
+    ideal_dcg = np.concatenate([[0.0], np.cumsum(discounts)])
+
+    true_positives = np.zeros(len(cutoffs))
+    retrieved = np.zeros(len(cutoffs))
+    relevant = float(n_relevant.sum())
+    reciprocal_ranks = np.zeros(len(cutoffs))
+    ndcg = np.zeros(len(cutoffs))
+    hit_queries = np.zeros(len(cutoffs))
+
+    for start in range(0, n_queries, chunk_size):
+        block = hits[start : start + chunk_size]
+        block_relevant = n_relevant[start : start + chunk_size]
+        block_retrieved = n_retrieved[start : start + chunk_size]
+
+        # Column 0 of each cumulative array is the value at k=0
+        cum_hits = np.zeros((len(block), max_k + 1), dtype=np.int32)
+        np.cumsum(block, axis=1, out=cum_hits[:, 1:])
+        cum_dcg = np.zeros((len(block), max_k + 1))
+        np.cumsum(block * discounts, axis=1, out=cum_dcg[:, 1:])
+        # 1-based rank of the first hit, or max_k + 1 when there is none
+        first_hit = (cum_hits[:, 1:] == 0).sum(axis=1) + 1
+
+        at_k = cum_hits[:, cutoffs]
+        true_positives += at_k.sum(axis=0)
+        retrieved += np.minimum(block_retrieved[:, None], cutoffs).sum(axis=0)
+        hit_queries += (at_k > 0).sum(axis=0)
+        within_k = first_hit[:, None] <= cutoffs
+        reciprocal_ranks += np.where(within_k, 1.0 / first_hit[:, None], 0.0).sum(
+            axis=0
+        )
+        best_dcg = ideal_dcg[np.minimum(block_relevant[:, None], cutoffs)]
+        ndcg += np.divide(
+            cum_dcg[:, cutoffs],
+            best_dcg,
+            out=np.zeros_like(best_dcg),
+            where=best_dcg > 0,
+        ).sum(axis=0)
+
+    results = {}
+    for i, k in enumerate(k_values):
+        per_query = max(n_queries, 1)
+        results[k] = {
+            "precision": float(true_positives[i] / max(retrieved[i], 1)),
+            "recall": float(true_positives[i] / max(relevant, 1)),
+            "mrr": float(reciprocal_ranks[i] / per_query),
+            "ndcg": float(ndcg[i] / per_query),
+            "hit_rate": float(hit_queries[i] / per_query),
+        }
+    return results
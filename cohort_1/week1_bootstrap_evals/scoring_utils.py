@@ -1,14 +1,15 @@
-import cohere
-from diskcache import Cache
+import asyncio
 import lancedb
-import os
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from pydantic import BaseModel
 from concurrent.futures import ThreadPoolExecutor
 
-
-cohere_api_key = os.environ["COHERE_API_KEY"]
+from candidate_cache import get_candidate_store
+from retrieval_metrics import compute_retrieval_metrics, hit_matrix_from_lists
+from rerank_store import get_rerank_store
+from rerank_scheduler import AsyncRerankScheduler
+from rerankers import CohereReranker, Reranker
 
 
 class EvalQuestion(BaseModel):
@@ -19,12 +20,13 @@ class EvalQuestion(BaseModel):
 
 
 def score(hits):
-    n_retrieval_requests = len(hits)
-    total_retrievals = sum(len(l) for l in hits)
-    true_positives = sum(sum(sublist) for sublist in hits)
-    precision = true_positives / total_retrievals if total_retrievals > 0 else 0
-    recall = true_positives / n_retrieval_requests if n_retrieval_requests > 0 else 0
-    return {"precision": precision, "recall": recall}
+    hit_matrix, n_retrieved = hit_matrix_from_lists(hits)
+    max_k = hit_matrix.shape[1]
+    metrics = compute_retrieval_metrics(hit_matrix, [max_k], n_retrieved=n_retrieved)
+    return {
+        "precision": metrics[max_k]["precision"],
+        "recall": metrics[max_k]["recall"],
+    }
 
 
 def run_reranked_request(
@@ -34,38 +36,20 @@ def run_reranked_request(
     n_to_rerank: int = 40,
     model: str = "rerank-english-v3.0",
 ) -> List[bool]:
-    cache = Cache("./cohere_cache")
-    cache_key = f"{q.question_with_context}_{max_n_return_vals}_{model}".replace(
-        "?", ""
-    )
-
-    cached_result = cache.get(cache_key)
-    if cached_result is not None:
-        return cached_result
-
-    initial_results = (
-        reviews_table.search(q.question_with_context)
-        .select(["id", "review"])
-        .limit(n_to_rerank)
-        .to_list()
+    initial_results = get_candidate_store().get(
+        reviews_table, q.question_with_context, n_to_rerank, columns=["id", "review"]
     )
 
     texts = [r["review"] for r in initial_results]
 
-    # Rerank using Cohere
-    co = cohere.Client(cohere_api_key)
-    reranked = co.rerank(
-        query=q.question_with_context,
-        documents=texts,
-        top_n=max_n_return_vals,
-        model=model,
+    # Rerank all candidates once, then answer any k from the stored ordering
+    reranked = get_rerank_store().top_k(
+        q.question_with_context, texts, max_n_return_vals, model
     )
 
     # Map reranked results back to original IDs
-    reranked_ids = [initial_results[r.index]["id"] for r in reranked.results]
-    result = [str(q.chunk_id) == str(r) for r in reranked_ids]
-    cache.set(cache_key, result)
-    return result
+    reranked_ids = [initial_results[index]["id"] for index, _ in reranked]
+    return [str(q.chunk_id) == str(r) for r in reranked_ids]
 
 
 def score_reranked_search(
@@ -74,21 +58,91 @@ def score_reranked_search(
     k_values: List[int],
     n_to_rerank: int = 40,
     model="rerank-english-v3.0",
+    reranker: Optional[Reranker] = None,
 ) -> Dict[int, Dict[str, float]]:
+    """
+    Score first-stage search followed by reranking.
+
+    By default this reranks with Cohere `model`. Pass any `Reranker`, e.g.
+    `CrossEncoderReranker("../week5_fine_tuning/fine_tuned_reranker")`, to
+    evaluate a local model instead; it sees all questions in one rerank_many call.
+    """
+    if reranker is None:
+        reranker = CohereReranker(model)
     max_k = max(k_values)
+    queries = [q.question_with_context for q in eval_questions]
     with ThreadPoolExecutor() as executor:
-        all_hits = list(
+        all_candidates = list(
             executor.map(
-                lambda q: run_reranked_request(
-                    q, reviews_table, max_k, n_to_rerank, model
+                lambda query: get_candidate_store().get(
+                    reviews_table, query, n_to_rerank, ["id", "review"]
                 ),
-                eval_questions,
+                queries,
             )
         )
 
-    results = {}
-    for k in k_values:
-        hits = [h[:k] for h in all_hits]
-        results[k] = score(hits)
+    orderings = reranker.rerank_many(
+        queries,
+        [[r["review"] for r in candidates] for candidates in all_candidates],
+    )
+    all_hits = [
+        [
+            str(q.chunk_id) == str(candidates[index]["id"])
+            for index, _ in ordering[:max_k]
+        ]
+        for q, candidates, ordering in zip(eval_questions, all_candidates, orderings)
+    ]
+
+    hit_matrix, n_retrieved = hit_matrix_from_lists(all_hits)
+    return compute_retrieval_metrics(hit_matrix, k_values, n_retrieved=n_retrieved)
+
+
+async def arun_reranked_request(
+    q: EvalQuestion,
+    reviews_table: lancedb.table.LanceTable,
+    max_n_return_vals: int,
+    scheduler: AsyncRerankScheduler,
+    n_to_rerank: int = 40,
+    model: str = "rerank-english-v3.0",
+) -> List[bool]:
+    initial_results = await asyncio.to_thread(
+        get_candidate_store().get,
+        reviews_table,
+        q.question_with_context,
+        n_to_rerank,
+        ["id", "review"],
+    )
+
+    texts = [r["review"] for r in initial_results]
+    ordering = await scheduler.rerank(q.question_with_context, texts, model)
+
+    reranked_ids = [initial_results[index]["id"] for index, _ in ordering]
+    return [str(q.chunk_id) == str(r) for r in reranked_ids[:max_n_return_vals]]
+
+
+async def ascore_reranked_search(
+    eval_questions: List[EvalQuestion],
+    reviews_table: lancedb.table.LanceTable,
+    k_values: List[int],
+    n_to_rerank: int = 40,
+    model="rerank-english-v3.0",
+    scheduler: Optional[AsyncRerankScheduler] = None,
+) -> Dict[int, Dict[str, float]]:
+    """
+    Async variant of score_reranked_search that sends rerank calls through a
+    rate-limited AsyncRerankScheduler instead of an unbounded thread pool.
+    """
+    if scheduler is None:
+        scheduler = AsyncRerankScheduler()
+    max_k = max(k_values)
+    all_hits = await asyncio.gather(
+        *[
+            arun_reranked_request(
+                q, reviews_table, max_k, scheduler, n_to_rerank, model
+            )
+            for q in eval_questions
+        ]
+    )
 
-    return results
+    hit_matrix, n_retrieved = hit_matrix_from_lists(all_hits)
+    return compute_retrieval_metrics(hit_matrix, k_values, n_retrieved=n_retrieved)
@@ -1,10 +1,15 @@
+import sys
 import openai
 import instructor
 from yaml_classifier import YamlClassifier
 from pydantic import BaseModel, Field, field_validator, ValidationInfo
 from typing import List
 
-client = instructor.from_openai(openai.OpenAI())
+sys.path.append("../../common")
+from llm_cache import cached_client
+
+# Cached, so rerunning the examples replays validated predictions from disk
+client = cached_client(instructor.from_openai(openai.OpenAI()))
 
 classifier = YamlClassifier.load("example.yaml")
 
@@ -42,9 +47,9 @@ print(resp.model_dump_json(indent=2))
 # > {"correct_labels": ["time_filter_requirement"]}
 
 # Example with batch prediction with asyncio
-from asyncio import run, gather
+from asyncio import run
 
-client = instructor.from_openai(openai.AsyncOpenAI())
+client = cached_client(instructor.from_openai(openai.AsyncOpenAI()))
 
 examples = [
     "When was the last time I asked you about dinner?",
@@ -57,19 +62,23 @@ examples = [
 
 
 async def run_predictions():
-    tasks = [
-        classifier.apredict(
-            client=client,  # type: ignore
+    # Bounded concurrency, results in input order, failures reported per item
+    return [
+        result
+        async for result in classifier.apredict_many(
+            examples,
             model="gpt-4o-mini",
-            query=query,
             response_model=Prediction,
+            client=client,  # type: ignore
+            max_concurrency=4,
         )
-        for query in examples
     ]
-    return await gather(*tasks)
 
 
 resp = run(run_predictions())
 
 for r in resp:
-    print(r.model_dump_json(indent=2))
+    if r.ok:
+        print(r.prediction.model_dump_json(indent=2))
+    else:
+        print(f"Failed to classify {r.query!r}: {r.error}")
@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+sys.path.append("../../common")
+from embedding_cache import normalize
+
+VECTORS_FILE = "vectors.npy"
+RECORDS_FILE = "records.json"
+
+
+class NumpyCollection:
+    """
+    Exact in-process vector index with the parts of the chroma collection API
+    RAGClassifier uses (get, upsert, delete, query, metadata, modify).
+
+    Example vectors are stored L2-normalized as float32 in `vectors.npy`, which
+    is memory-mapped on load. Ids, documents and metadatas are kept in
+    `records.json`, in the same row order. A query is one matrix multiply for
+    the whole batch plus an argpartition per row. Distances are squared L2
+    between normalized vectors (2 - 2 * cosine), chroma's default space, so a
+    calibrated fast_path_threshold means the same on both backends.
+
+    Writes rewrite both files, which is fine for label-example sets of a few
+    thousand rows. With `directory=None` everything stays in memory.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        embedding_function: Callable[[List[str]], List[List[float]]],
+        directory: Optional[str] = None,
+    ):
+        self.name = name
+        self.embedding_function = embedding_function
+        self.directory = directory
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[dict] = []
+        self.metadata: Optional[Dict] = None
+        if directory and os.path.exists(os.path.join(directory, RECORDS_FILE)):
+            self._load()
+
+    def _load(self):
+        with open(os.path.join(self.directory, RECORDS_FILE)) as f:
+            records = json.load(f)
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+        self.metadata = records["metadata"]
+        self.vectors = np.load(
+            os.path.join(self.directory, VECTORS_FILE), mmap_mode="r"
+        )
+
+    def _save(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to temporary files and swap them in, so a crash never leaves
+        # vectors and records out of sync
+        vectors_path = os.path.join(self.directory, VECTORS_FILE)
+        records_path = os.path.join(self.directory, RECORDS_FILE)
+        with open(vectors_path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors))
+        with open(records_path + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "ids": self.ids,
+                    "documents": self.documents,
+                    "metadatas": self.metadatas,
+                    "metadata": self.metadata,
+                },
+                f,
+            )
+        os.replace(vectors_path + ".tmp", vectors_path)
+        os.replace(records_path + ".tmp", records_path)
+        self.vectors = np.load(vectors_path, mmap_mode="r")
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def get(self, include: Optional[List[str]] = None) -> Dict:
+        return {
+            "ids": list(self.ids),
+            "documents": list(self.documents),
+            "metadatas": list(self.metadatas),
+        }
+
+    def modify(self, metadata: Optional[Dict] = None):
+        self.metadata = metadata
+        self._save()
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[dict]):
+        vectors = normalize(self.embedding_function(documents))
+        positions = {key: row for row, key in enumerate(self.ids)}
+        new_rows = []
+        stored = np.array(self.vectors)
+        for key, document, metadata, vector in zip(ids, documents, metadatas, vectors):
+            if key in positions:
+                row = positions[key]
+                stored[row] = vector
+                self.documents[row] = document
+                self.metadatas[row] = metadata
+            else:
+                positions[key] = len(self.ids)
+                self.ids.append(key)
+                self.documents.append(document)
+                self.metadatas.append(metadata)
+                new_rows.append(vector)
+        if new_rows:
+            stored = (
+                np.vstack([stored, new_rows]) if len(stored) else np.stack(new_rows)
+            )
+        self.vectors = stored
+        self._save()
+
+    def delete(self, ids: List[str]):
+        removed = set(ids)
+        keep = [row for row, key in enumerate(self.ids) if key not in removed]
+        self.vectors = np.array(self.vectors)[keep]
+        self.ids = [self.ids[row] for row in keep]
+        self.documents = [self.documents[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self._save()
+
+    def query_embeddings(self, embeddings: np.ndarray, n_results: int) -> Dict:
+        n_results = min(n_results, len(self.ids))
+        similarities = normalize(embeddings) @ np.asarray(self.vectors).T
+        if n_results < len(self.ids):
+            top = np.argpartition(-similarities, n_results - 1, axis=1)[:, :n_results]
+        else:
+            top = np.tile(np.arange(len(self.ids)), (len(similarities), 1))
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        distances = np.maximum(
+            2.0 - 2.0 * np.take_along_axis(top_similarities, order, axis=1), 0.0
+        )
+        return {
+            "ids": [[self.ids[row] for row in rows] for rows in top],
+            "documents": [[self.documents[row] for row in rows] for rows in top],
+            "metadatas": [[self.metadatas[row] for row in rows] for rows in top],
+            "distances": distances.tolist(),
+        }
+
+    def query(self, query_texts: List[str], n_results: int = 10) -> Dict:
+        if not self.ids:
+            return {
+                key: [[] for _ in query_texts]
+                for key in ("ids", "documents", "metadatas", "distances")
+            }
+        embeddings = np.asarray(self.embedding_function(query_texts), dtype=np.float32)
+        return self.query_embeddings(embeddings, n_results)
+
+
+class NumpyVectorStore:
+    """
+    Drop-in for a chroma client: one NumpyCollection per subdirectory of `path`,
+    or in memory when `path` is None.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+
+    def get_or_create_collection(
+        self, name: str, embedding_function
+    ) -> NumpyCollection:
+        directory = os.path.join(self.path, name) if self.path else None
+        return NumpyCollection(name, embedding_function, directory)
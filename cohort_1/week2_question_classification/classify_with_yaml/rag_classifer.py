@@ -1,105 +1,523 @@
+import asyncio
+import hashlib
+import itertools
+import sys
 import chromadb
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 from jinja2 import Template
-from yaml_classifier import YamlClassifier
+from yaml_classifier import BatchPrediction, T, YamlClassifier
+from numpy_index import NumpyVectorStore
 from textwrap import dedent
-from pydantic import Field
-import chromadb.utils.embedding_functions as embedding_functions
-import os
-from pydantic import Field
+from typing import (
+    AsyncIterator,
+    ClassVar,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Type,
+)
+from pydantic import BaseModel, Field, PrivateAttr, ValidationError
 import instructor
 import openai
+from concurrent.futures import ThreadPoolExecutor
+from instructor import AsyncInstructor, Instructor
+
+sys.path.append("../../common")
+from embedding_cache import Embedder, EmbeddingCache, openai_embedder
+
+# Neighbours fetched when fetch_n_examples is None, chroma's default n_results
+DEFAULT_N_RESULTS = 10
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function backed by an EmbeddingCache."""
+
+    def __init__(self, cache: EmbeddingCache):
+        self.cache = cache
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self.cache.embed(input).tolist()
+
+
+class Neighbour(BaseModel):
+    document: str
+    label: str
+    distance: float
+    negative: bool = False
+
+
+def example_id(text: str, label: str, negative: bool) -> str:
+    """Content-hash id, stable across reordering of the YAML file."""
+    key = f"{label}\0{int(negative)}\0{text}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def drop_document(neighbours: List[Neighbour], document: str) -> List[Neighbour]:
+    for i, neighbour in enumerate(neighbours):
+        if neighbour.document == document:
+            return neighbours[:i] + neighbours[i + 1 :]
+    return neighbours
 
 
 class RAGClassifier(YamlClassifier):
     fetch_n_examples: int | None = Field(default=2)
+    # When set, queries whose neighbours are all positive examples of one label
+    # within this distance are labelled without an LLM call
+    fast_path_threshold: float | None = Field(default=None)
+    embedding_model: str = Field(default="text-embedding-3-small")
+    # "numpy" keeps example vectors in a memory-mapped .npy file (see
+    # numpy_index.py), which starts and searches faster than chroma for a few
+    # thousand examples
+    vector_backend: Literal["chroma", "numpy"] = Field(default="chroma")
     __db = None
+    _embedder: Optional[Embedder] = PrivateAttr(default=None)
+    _embedding_cache: Optional[EmbeddingCache] = PrivateAttr(default=None)
+
+    # Compiled once per class rather than on every query
+    user_template: ClassVar[Template] = Template(
+        dedent(
+            """
+        Classify the following document:
 
-    def load_db(self, collection_name: str):
+        <doc>
+        {{ query }}
+        </doc>
+
+        Similar examples:
+        <examples>
+        {% for doc, label, distance in formatted_results %}
+        <example>
+            <distance> {{ "%.2f"|format(distance) }} </distance>
+            <label> {{ label }} </label>
+            <similar_document> {{ doc }} </similar_document>
+        </example>
+        {% endfor %}
+        </examples>
+
+        Provide your classification based on the above information.
+        """
+        )
+    )
+
+    def get_chroma_client(self, persist_directory: Optional[str] = None):
+        if self.vector_backend == "numpy":
+            return NumpyVectorStore(persist_directory)
+        if persist_directory:
+            return chromadb.PersistentClient(path=persist_directory)
+        return chromadb.Client()
+
+    def load_db(self, collection_name: str, persist_directory: Optional[str] = None):
         if collection_name:
-            chroma_client = chromadb.Client()
+            chroma_client = self.get_chroma_client(persist_directory)
             self.__db = chroma_client.get_or_create_collection(
                 name=collection_name,
                 embedding_function=self.get_embedding_function(),
             )
         return self
 
+    def set_embedder(self, embedder: Embedder, model_name: str):
+        """
+        Embed with `embedder` (e.g. embedding_cache.hashing_embedder() for tests
+        and offline runs) instead of the OpenAI API. `model_name` keys the cache.
+        """
+        self._embedder = embedder
+        self.embedding_model = model_name
+        self._embedding_cache = None
+        return self
+
+    def get_embedding_cache(self) -> EmbeddingCache:
+        if self._embedding_cache is None:
+            embedder = self._embedder or openai_embedder(self.embedding_model)
+            self._embedding_cache = EmbeddingCache(embedder, self.embedding_model)
+        return self._embedding_cache
+
     def get_embedding_function(self):
-        return embedding_functions.OpenAIEmbeddingFunction(
-            api_key=os.environ.get("OPENAI_API_KEY"),
-            model_name="text-embedding-3-small",
-        )
+        # Batched and cached on disk, so refitting unchanged examples (or
+        # repeating a query) makes no embedding requests
+        return CachedEmbeddingFunction(self.get_embedding_cache())
 
-    def fit(self, collection_name: str):
-        chroma_client = chromadb.Client()
+    def fit(self, collection_name: str, persist_directory: Optional[str] = None):
+        """
+        Sync the collection with the YAML examples.
 
-        self.__db = chroma_client.get_or_create_collection(
-            name=collection_name, embedding_function=self.get_embedding_function()
-        )
+        Ids are content hashes, so only added or edited examples are embedded
+        and removed ones are deleted. With `persist_directory` the collection
+        survives restarts, and refitting an unchanged file is a no-op. Changing
+        `embedding_model` rebuilds the collection.
+        """
+        self.load_db(collection_name, persist_directory)
+        if (self.__db.metadata or {}).get("embedding_model") != self.embedding_model:
+            # Vectors from another embedding model aren't comparable, start over
+            stale_ids = self.__db.get(include=[])["ids"]
+            if stale_ids:
+                self.__db.delete(ids=stale_ids)
+            self.__db.modify(metadata={"embedding_model": self.embedding_model})
 
-        all_examples = []
+        all_examples = {}
         for label in self.labels:
             for example in label.examples.positive:
-                all_examples.append({"text": example, "label": label.name})
+                all_examples[example_id(example, label.name, False)] = {
+                    "text": example,
+                    "label": label.name,
+                    "negative": False,
+                }
             for example in label.examples.negative:
-                all_examples.append({"text": example, "label": label.name})
+                all_examples[example_id(example, label.name, True)] = {
+                    "text": example,
+                    "label": label.name,
+                    "negative": True,
+                }
 
-        # Upsert all examples into the database
-        self.__db.upsert(
-            documents=[example["text"] for example in all_examples],
-            ids=[str(i) for i in range(len(all_examples))],
-            metadatas=[{"label": example["label"]} for example in all_examples],
-        )
+        existing_ids = set(self.__db.get(include=[])["ids"])
+        added_ids = [key for key in all_examples if key not in existing_ids]
+        removed_ids = [key for key in existing_ids if key not in all_examples]
 
-    def get_user_query(self, query: str) -> str:
+        if removed_ids:
+            self.__db.delete(ids=removed_ids)
+        # Upsert only the new examples, so unchanged ones are never re-embedded
+        if added_ids:
+            self.__db.upsert(
+                documents=[all_examples[key]["text"] for key in added_ids],
+                ids=added_ids,
+                metadatas=[
+                    {
+                        "label": all_examples[key]["label"],
+                        "negative": all_examples[key]["negative"],
+                    }
+                    for key in added_ids
+                ],
+            )
+        return {
+            "added": len(added_ids),
+            "removed": len(removed_ids),
+            "unchanged": len(all_examples) - len(added_ids),
+        }
+
+    def n_neighbours(self) -> int:
+        if self.fetch_n_examples is None:
+            return DEFAULT_N_RESULTS
+        return self.fetch_n_examples
+
+    def get_neighbours(
+        self, queries: List[str], n_results: Optional[int] = None
+    ) -> List[List[Neighbour]]:
         if self.__db is None:
             raise ValueError("Database not initialized, call cls.fit() first")
         results = self.__db.query(
-            query_texts=[query],
-            n_results=self.fetch_n_examples,
+            query_texts=queries,
+            n_results=n_results or self.n_neighbours(),
         )
-        formatted_results = [
-            (doc, metadata["label"], distance)
-            for doc, metadata, distance in zip(
-                results["documents"][0],
-                results["metadatas"][0],
-                results["distances"][0],
+        return [
+            [
+                Neighbour(
+                    document=doc,
+                    label=metadata["label"],
+                    distance=distance,
+                    negative=metadata.get("negative", False),
+                )
+                for doc, metadata, distance in zip(docs, metadatas, distances)
+            ]
+            for docs, metadatas, distances in zip(
+                results["documents"], results["metadatas"], results["distances"]
             )
         ]
 
-        template = Template(
-            dedent(
-                """
-        Classify the following document:
+    def render_user_query(self, query: str, neighbours: List[Neighbour]) -> str:
+        formatted_results = [
+            (neighbour.document, neighbour.label, neighbour.distance)
+            for neighbour in neighbours
+        ]
+        return self.user_template.render(
+            query=query, formatted_results=formatted_results
+        )
 
-        <doc>
-        {{ query }}
-        </doc>
+    def get_user_query(self, query: str) -> str:
+        return self.render_user_query(query, self.get_neighbours([query])[0])
 
-        Similar examples:
-        <examples>
-        {% for doc, label, distance in formatted_results %}
-        <example>
-            <distance> {{ "%.2f"|format(distance) }} </distance>
-            <label> {{ label }} </label>
-            <similar_document> {{ doc }} </similar_document>
-        </example>
-        {% endfor %}
-        </examples>
+    def get_user_queries(self, queries: List[str]) -> List[str]:
+        # One embedding call and one vector query for the whole list
+        return [
+            self.render_user_query(query, neighbours)
+            for query, neighbours in zip(queries, self.get_neighbours(queries))
+        ]
 
-        Provide your classification based on the above information.
+    def with_neighbours(
+        self, queries: Iterable[str], batch_size: int
+    ) -> Iterator[Tuple[str, dict]]:
+        """
+        Pair each query with `neighbours=` for predict, looking them up
+        `batch_size` queries per embedding call and vector query.
         """
+        queries = iter(queries)
+        while True:
+            batch = list(itertools.islice(queries, batch_size))
+            if not batch:
+                return
+            for query, neighbours in zip(batch, self.get_neighbours(batch)):
+                yield query, {"neighbours": neighbours}
+
+    async def awith_neighbours(
+        self, queries: Iterable[str], batch_size: int
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        """Async version of with_neighbours, running each lookup in a thread."""
+        queries = iter(queries)
+        while True:
+            batch = list(itertools.islice(queries, batch_size))
+            if not batch:
+                return
+            found = await asyncio.to_thread(self.get_neighbours, batch)
+            for query, neighbours in zip(batch, found):
+                yield query, {"neighbours": neighbours}
+
+    def agreed_label(self, neighbours: List[Neighbour]) -> Optional[str]:
+        """The label shared by every neighbour, if they are all positive examples of it."""
+        labels = {neighbour.label for neighbour in neighbours}
+        if len(labels) != 1 or any(neighbour.negative for neighbour in neighbours):
+            return None
+        return labels.pop()
+
+    def fast_label(self, neighbours: List[Neighbour]) -> Optional[str]:
+        if self.fast_path_threshold is None or not neighbours:
+            return None
+        if (
+            max(neighbour.distance for neighbour in neighbours)
+            > self.fast_path_threshold
+        ):
+            return None
+        return self.agreed_label(neighbours)
+
+    def prediction_from_label(self, response_model: Type[T], label: str) -> Optional[T]:
+        """
+        Build `response_model` from a single label by filling every field whose
+        name contains "label". Returns None when the model needs anything else
+        (e.g. a `reasoning` field), in which case the LLM has to answer.
+        """
+        values = {
+            name: label if field.annotation is str else [label]
+            for name, field in response_model.model_fields.items()
+            if "label" in name
+        }
+        if not values:
+            return None
+        try:
+            return response_model.model_validate(
+                values, context={"labels": self.get_labels()}
             )
+        except ValidationError:
+            return None
+
+    def fast_predict(
+        self, neighbours: List[Neighbour], response_model: Type[T]
+    ) -> Optional[T]:
+        label = self.fast_label(neighbours)
+        if label is None:
+            return None
+        return self.prediction_from_label(response_model, label)
+
+    def predict(
+        self,
+        query: str,
+        model: str,
+        response_model: Type[T],
+        client: Instructor,
+        neighbours: Optional[List[Neighbour]] = None,
+    ):
+        if neighbours is None:
+            neighbours = self.get_neighbours([query])[0]
+        prediction = self.fast_predict(neighbours, response_model)
+        if prediction is not None:
+            return prediction
+        return client.create(
+            model=model,
+            response_model=response_model,
+            messages=self.get_messages(self.render_user_query(query, neighbours)),
+            validation_context={
+                "labels": self.get_labels(),
+            },
         )
 
-        return template.render(query=query, formatted_results=formatted_results)
+    async def apredict(
+        self,
+        query: str,
+        model: str,
+        response_model: Type[T],
+        client: AsyncInstructor,
+        neighbours: Optional[List[Neighbour]] = None,
+    ):
+        if neighbours is None:
+            neighbours = (await asyncio.to_thread(self.get_neighbours, [query]))[0]
+        prediction = self.fast_predict(neighbours, response_model)
+        if prediction is not None:
+            return prediction
+        return await client.create(
+            messages=self.get_messages(self.render_user_query(query, neighbours)),
+            model=model,
+            response_model=response_model,
+            validation_context={
+                "labels": self.get_labels(),
+            },
+        )
+
+    def predict_many(
+        self,
+        queries: Iterable[str],
+        model: str,
+        response_model: Type[T],
+        client: Instructor,
+        max_concurrency: int = 8,
+        ordered: bool = True,
+        lookup_batch_size: int = 256,
+    ) -> Iterator[BatchPrediction]:
+        """
+        YamlClassifier.predict_many, with neighbours looked up for
+        `lookup_batch_size` queries per embedding call and vector query.
+        """
+        yield from self._predict_many(
+            self.with_neighbours(queries, lookup_batch_size),
+            model,
+            response_model,
+            client,
+            max_concurrency=max_concurrency,
+            ordered=ordered,
+        )
+
+    async def apredict_many(
+        self,
+        queries: Iterable[str],
+        model: str,
+        response_model: Type[T],
+        client: AsyncInstructor,
+        max_concurrency: int = 8,
+        ordered: bool = True,
+        lookup_batch_size: int = 256,
+    ) -> AsyncIterator[BatchPrediction]:
+        """
+        YamlClassifier.apredict_many, with neighbours looked up for
+        `lookup_batch_size` queries per embedding call and vector query instead
+        of one round trip per query. Lookups run in a thread, so they don't
+        block requests already in flight.
+        """
+        async for result in self._apredict_many(
+            self.awith_neighbours(queries, lookup_batch_size),
+            model,
+            response_model,
+            client,
+            max_concurrency=max_concurrency,
+            ordered=ordered,
+        ):
+            yield result
+
+    def calibrate_fast_path(
+        self,
+        max_accuracy_drop: float = 0.0,
+        model: Optional[str] = None,
+        response_model: Optional[Type[T]] = None,
+        client: Optional[Instructor] = None,
+        max_concurrency: int = 8,
+    ) -> List[dict]:
+        """
+        Choose `fast_path_threshold` using the positive examples in the YAML file.
+
+        Each example is classified leave-one-out: its neighbours come from the
+        fitted collection with the example itself removed. Every candidate
+        threshold gets a report row with the fraction of LLM calls avoided and
+        the accuracy change relative to sending every query to the LLM. Without
+        a client the LLM is assumed to always be right, so the accuracy change
+        counts every fast-path mistake.
+
+        The largest threshold whose accuracy drop is at most `max_accuracy_drop`
+        is set on the classifier. If no threshold qualifies, the fast path is
+        turned off.
+        """
+        examples = [
+            (text, label.name)
+            for label in self.labels
+            for text in label.examples.positive
+        ]
+        texts = [text for text, _ in examples]
+        n_neighbours = self.n_neighbours()
+        neighbours = [
+            drop_document(found, text)[:n_neighbours]
+            for text, found in zip(
+                texts, self.get_neighbours(texts, n_results=n_neighbours + 1)
+            )
+        ]
+
+        if client is None:
+            llm_correct = [True] * len(examples)
+        else:
+
+            def llm_labels(i: int) -> List[str]:
+                try:
+                    prediction = client.create(
+                        model=model,
+                        response_model=response_model,
+                        messages=self.get_messages(
+                            self.render_user_query(texts[i], neighbours[i])
+                        ),
+                        validation_context={"labels": self.get_labels()},
+                    )
+                except Exception:
+                    return []
+                return [
+                    value
+                    for name, values in prediction.model_dump().items()
+                    if "label" in name
+                    for value in ([values] if isinstance(values, str) else values)
+                ]
+
+            with ThreadPoolExecutor(max_concurrency) as executor:
+                predicted = list(executor.map(llm_labels, range(len(examples))))
+            llm_correct = [
+                label in labels for (_, label), labels in zip(examples, predicted)
+            ]
+
+        # Examples the fast path could answer, ordered by the distance it needs
+        candidates = sorted(
+            (max(n.distance for n in found), self.agreed_label(found) == label, i)
+            for i, ((_, label), found) in enumerate(zip(examples, neighbours))
+            if found and self.agreed_label(found) is not None
+        )
+
+        baseline_correct = sum(llm_correct)
+        n = len(examples)
+        report = []
+        n_fast, delta = 0, 0
+        for position, (distance, fast_correct, i) in enumerate(candidates):
+            n_fast += 1
+            delta += int(fast_correct) - int(llm_correct[i])
+            if (
+                position + 1 < len(candidates)
+                and candidates[position + 1][0] == distance
+            ):
+                continue
+            report.append(
+                {
+                    "threshold": distance,
+                    "llm_calls_avoided": n_fast / n,
+                    "accuracy": (baseline_correct + delta) / n,
+                    "baseline_accuracy": baseline_correct / n,
+                    "accuracy_change": delta / n,
+                }
+            )
+
+        accepted = [
+            row for row in report if row["accuracy_change"] >= -max_accuracy_drop
+        ]
+        self.fast_path_threshold = accepted[-1]["threshold"] if accepted else None
+        return report
 
 
 if __name__ == "__main__":
     client = instructor.from_openai(openai.OpenAI())
 
     classifier = RAGClassifier.load("example.yaml")
-    classifier.fit("example")
-    # classifier.load_db("example")
+    # Persisted, so only added or edited examples are embedded on later runs
+    print(classifier.fit("example", persist_directory="./rag_classifier_db"))
+    # classifier.load_db("example", persist_directory="./rag_classifier_db")
 
     print("# Example of User Query")
     print(
@@ -107,3 +525,13 @@ if __name__ == "__main__":
             "When can i expect to see the next episode of the show?"
         )
     )
+
+    print("# Fast path calibration")
+    report = classifier.calibrate_fast_path()
+    for row in report:
+        print(
+            f"threshold={row['threshold']:.3f} "
+            f"llm_calls_avoided={row['llm_calls_avoided']:.1%} "
+            f"accuracy_change={row['accuracy_change']:+.1%}"
+        )
+    print(f"Using fast_path_threshold={classifier.fast_path_threshold}")
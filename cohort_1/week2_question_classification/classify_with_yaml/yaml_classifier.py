@@ -1,5 +1,17 @@
-from pydantic import BaseModel, Field
-from typing import List
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from pydantic import BaseModel, Field, PrivateAttr, ValidationError, create_model
+from typing import (
+    Any,
+    AsyncIterator,
+    ClassVar,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 from pydantic import BaseModel, field_validator
 from instructor import Instructor, AsyncInstructor
 from jinja2 import Template
@@ -28,6 +40,19 @@ class Label(BaseModel):
         return v
 
 
+class BatchPrediction(BaseModel):
+    """One item of a predict_many / apredict_many batch."""
+
+    index: int
+    query: str
+    prediction: Optional[Any] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
 class YamlClassifier(BaseModel):
     task: str
     description: str
@@ -36,19 +61,10 @@ class YamlClassifier(BaseModel):
         default=100, description="Number of examples to use for each label"
     )
 
-    @classmethod
-    def load(cls, fn: str):
-        import yaml
-
-        with open(fn, "r") as file:
-            data = yaml.safe_load(file)
-
-        return cls(**data)
-
-    def to_system_messages(self) -> str:
-        template = Template(
-            dedent(
-                """
+    # Compiled once per class rather than on every predict call
+    system_template: ClassVar[Template] = Template(
+        dedent(
+            """
         <task>
             {{ task }}
         </task>
@@ -101,31 +117,56 @@ class YamlClassifier(BaseModel):
         7. Provide your classification as a single word matching the chosen label's name.
         8. Do not assume any specific task unless it's explicitly mentioned in the 'task' variable.
         """
-            )
         )
-        return template.render(self.model_dump())
+    )
+    _system_message_cache: Optional[Tuple[str, str]] = PrivateAttr(default=None)
+
+    @classmethod
+    def load(cls, fn: str):
+        import yaml
+
+        with open(fn, "r") as file:
+            data = yaml.safe_load(file)
+
+        return cls(**data)
+
+    def to_system_messages(self) -> str:
+        # The rendered prompt only depends on the classifier's fields, so reuse it
+        # until they change. Rendering is deterministic, which keeps the system
+        # message a byte-stable prefix for provider-side prompt caching.
+        state = self.model_dump_json()
+        if self._system_message_cache is None or self._system_message_cache[0] != state:
+            self._system_message_cache = (
+                state,
+                self.system_template.render(self.model_dump()),
+            )
+        return self._system_message_cache[1]
 
     def get_user_query(self, query: str) -> str:
         return f"Correctly Classify:\n\n{query}"
 
+    def get_user_queries(self, queries: List[str]) -> List[str]:
+        return [self.get_user_query(query) for query in queries]
+
     def get_labels(self) -> List[str]:
         return [label.name for label in self.labels]
 
+    def get_messages(self, user_query: str) -> List[dict]:
+        return [
+            {"role": "system", "content": self.to_system_messages()},
+            {"role": "user", "content": user_query},
+        ]
+
     def set_client(self, client: Instructor):
         self._client = client
 
     def predict(
         self, query: str, model: str, response_model: Type[T], client: Instructor
     ):
-        system_message = self.to_system_messages()
-        user_query = self.get_user_query(query)
         return client.create(
             model=model,
             response_model=response_model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_query},
-            ],
+            messages=self.get_messages(self.get_user_query(query)),
             validation_context={
                 "labels": self.get_labels(),
             },
@@ -134,16 +175,359 @@ class YamlClassifier(BaseModel):
     async def apredict(
         self, query: str, model: str, response_model: Type[T], client: AsyncInstructor
     ):
-        system_message = self.to_system_messages()
-        user_query = self.get_user_query(query)
         return await client.create(
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_query},
-            ],
+            messages=self.get_messages(self.get_user_query(query)),
             model=model,
             response_model=response_model,
             validation_context={
                 "labels": self.get_labels(),
             },
         )
+
+    def _batch_item(self, index: int, query: str, run) -> BatchPrediction:
+        try:
+            return BatchPrediction(index=index, query=query, prediction=run())
+        except Exception as e:
+            return BatchPrediction(
+                index=index, query=query, error=f"{type(e).__name__}: {e}"
+            )
+
+    def predict_many(
+        self,
+        queries: Iterable[str],
+        model: str,
+        response_model: Type[T],
+        client: Instructor,
+        max_concurrency: int = 8,
+        ordered: bool = True,
+    ) -> Iterator[BatchPrediction]:
+        """
+        Classify many queries with at most `max_concurrency` requests in flight.
+
+        Queries are read lazily, so `queries` can be a generator over a large log.
+        Results are yielded in input order (ordered=True) or as they complete.
+        A failing query yields a BatchPrediction with `error` set instead of
+        aborting the batch.
+        """
+        yield from self._predict_many(
+            ((query, {}) for query in queries),
+            model,
+            response_model,
+            client,
+            max_concurrency=max_concurrency,
+            ordered=ordered,
+        )
+
+    def _predict_many(
+        self,
+        inputs: Iterable[Tuple[str, dict]],
+        model: str,
+        response_model: Type[T],
+        client: Instructor,
+        max_concurrency: int = 8,
+        ordered: bool = True,
+    ) -> Iterator[BatchPrediction]:
+        # `inputs` pairs each query with extra keyword arguments for predict,
+        # so subclasses can pass along context they looked up in batches.
+        # Bound how far ahead of the consumer we read, so memory stays flat
+        window = max_concurrency * 4
+        with ThreadPoolExecutor(max_concurrency) as executor:
+            pending = deque() if ordered else set()
+            for index, (query, predict_kwargs) in enumerate(inputs):
+                future = executor.submit(
+                    self._batch_item,
+                    index,
+                    query,
+                    lambda query=query, predict_kwargs=predict_kwargs: self.predict(
+                        query, model, response_model, client, **predict_kwargs
+                    ),
+                )
+                if ordered:
+                    pending.append(future)
+                    if len(pending) >= window:
+                        yield pending.popleft().result()
+                else:
+                    pending.add(future)
+                    if len(pending) >= window:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for finished in done:
+                            yield finished.result()
+
+            if ordered:
+                while pending:
+                    yield pending.popleft().result()
+            else:
+                for finished in as_completed(pending):
+                    yield finished.result()
+
+    async def apredict_many(
+        self,
+        queries: Iterable[str],
+        model: str,
+        response_model: Type[T],
+        client: AsyncInstructor,
+        max_concurrency: int = 8,
+        ordered: bool = True,
+    ) -> AsyncIterator[BatchPrediction]:
+        """
+        Async version of predict_many:
+
+            async for result in classifier.apredict_many(queries, ...):
+                if result.ok:
+                    print(result.index, result.prediction)
+        """
+
+        async def inputs() -> AsyncIterator[Tuple[str, dict]]:
+            for query in queries:
+                yield query, {}
+
+        async for result in self._apredict_many(
+            inputs(),
+            model,
+            response_model,
+            client,
+            max_concurrency=max_concurrency,
+            ordered=ordered,
+        ):
+            yield result
+
+    async def _apredict_many(
+        self,
+        inputs: AsyncIterator[Tuple[str, dict]],
+        model: str,
+        response_model: Type[T],
+        client: AsyncInstructor,
+        max_concurrency: int = 8,
+        ordered: bool = True,
+    ) -> AsyncIterator[BatchPrediction]:
+        # Async version of _predict_many, with extra keyword arguments for apredict
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(index: int, query: str, predict_kwargs: dict) -> BatchPrediction:
+            async with semaphore:
+                try:
+                    prediction = await self.apredict(
+                        query, model, response_model, client, **predict_kwargs
+                    )
+                except Exception as e:
+                    return BatchPrediction(
+                        index=index, query=query, error=f"{type(e).__name__}: {e}"
+                    )
+            return BatchPrediction(index=index, query=query, prediction=prediction)
+
+        window = max_concurrency * 4
+        pending = deque() if ordered else set()
+        index = 0
+        try:
+            async for query, predict_kwargs in inputs:
+                task = asyncio.create_task(run(index, query, predict_kwargs))
+                index += 1
+                if ordered:
+                    pending.append(task)
+                    if len(pending) >= window:
+                        yield await pending.popleft()
+                else:
+                    pending.add(task)
+                    if len(pending) >= window:
+                        done, pending = await asyncio.wait(
+                            pending, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        for finished in done:
+                            yield finished.result()
+
+            if ordered:
+                while pending:
+                    yield await pending.popleft()
+            else:
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for finished in done:
+                        yield finished.result()
+        finally:
+            # The consumer stopped early: don't leave requests running
+            for task in pending:
+                task.cancel()
+
+    def get_packed_user_query(self, queries: List[str]) -> str:
+        parts = [
+            f'<query index="{index}">\n{user_query}\n</query>'
+            for index, user_query in enumerate(self.get_user_queries(queries))
+        ]
+        return (
+            "Classify each of the following queries independently. Return exactly one "
+            "prediction per query, with `index` set to that query's index.\n\n"
+            + "\n\n".join(parts)
+        )
+
+    def packed_response_model(self, response_model: Type[T]) -> Type[BaseModel]:
+        """
+        Build the list response model for a packed request.
+
+        Items copy the fields of `response_model` plus an `index`, but not its
+        validators, so one bad item can't make the whole request fail. Each item
+        is validated against `response_model` separately in `unpack`.
+        """
+        fields = {
+            name: (field.annotation, field)
+            for name, field in response_model.model_fields.items()
+        }
+        item = create_model(
+            f"Packed{response_model.__name__}",
+            index=(int, Field(description="Index of the query being classified")),
+            **fields,
+        )
+        return create_model(
+            f"Packed{response_model.__name__}List",
+            predictions=(List[item], Field(description="One prediction per query")),
+        )
+
+    def has_unknown_labels(self, prediction: BaseModel) -> bool:
+        labels = self.get_labels()
+        for name in type(prediction).model_fields:
+            if "label" not in name:
+                continue
+            value = getattr(prediction, name)
+            values = [value] if isinstance(value, str) else value
+            if isinstance(values, list) and any(
+                isinstance(v, str) and v not in labels for v in values
+            ):
+                return True
+        return False
+
+    def unpack(
+        self, queries: List[str], packed: BaseModel, response_model: Type[T]
+    ) -> List[Optional[T]]:
+        """
+        Map packed predictions back to their queries. Items that are missing,
+        duplicated, fail `response_model` validation or use a label outside
+        get_labels() come back as None.
+        """
+        results: List[Optional[T]] = [None] * len(queries)
+        for item in packed.predictions:
+            if not 0 <= item.index < len(queries) or results[item.index] is not None:
+                continue
+            try:
+                prediction = response_model.model_validate(
+                    item.model_dump(exclude={"index"}),
+                    context={"labels": self.get_labels()},
+                )
+            except ValidationError:
+                continue
+            if not self.has_unknown_labels(prediction):
+                results[item.index] = prediction
+        return results
+
+    def predict_packed(
+        self,
+        queries: Iterable[str],
+        model: str,
+        response_model: Type[T],
+        client: Instructor,
+        pack_size: int = 20,
+    ) -> List[BatchPrediction]:
+        """
+        Classify queries `pack_size` at a time, one request per pack.
+
+        The system prompt (every label and its examples) is sent once per pack
+        instead of once per query. Queries whose packed prediction is missing or
+        invalid are re-classified with a single-query `predict` call.
+        """
+        queries = list(queries)
+        results = []
+        for start in range(0, len(queries), pack_size):
+            pack = queries[start : start + pack_size]
+            try:
+                packed = client.create(
+                    model=model,
+                    response_model=self.packed_response_model(response_model),
+                    messages=self.get_messages(self.get_packed_user_query(pack)),
+                    validation_context={"labels": self.get_labels()},
+                )
+                predictions = self.unpack(pack, packed, response_model)
+            except Exception:
+                predictions = [None] * len(pack)
+
+            for index, (query, prediction) in enumerate(zip(pack, predictions), start):
+                if prediction is None:
+                    results.append(
+                        self._batch_item(
+                            index,
+                            query,
+                            lambda: self.predict(query, model, response_model, client),
+                        )
+                    )
+                else:
+                    results.append(
+                        BatchPrediction(index=index, query=query, prediction=prediction)
+                    )
+        return results
+
+    async def apredict_packed(
+        self,
+        queries: Iterable[str],
+        model: str,
+        response_model: Type[T],
+        client: AsyncInstructor,
+        pack_size: int = 20,
+        max_concurrency: int = 4,
+    ) -> List[BatchPrediction]:
+        """
+        Async version of predict_packed, sending up to `max_concurrency` packs
+        (or single-query fallbacks) at once.
+        """
+        queries = list(queries)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def classify_one(index: int, query: str) -> BatchPrediction:
+            async with semaphore:
+                try:
+                    prediction = await self.apredict(
+                        query, model, response_model, client
+                    )
+                except Exception as e:
+                    return BatchPrediction(
+                        index=index, query=query, error=f"{type(e).__name__}: {e}"
+                    )
+            return BatchPrediction(index=index, query=query, prediction=prediction)
+
+        async def classify_pack(start: int) -> List[BatchPrediction]:
+            pack = queries[start : start + pack_size]
+            async with semaphore:
+                try:
+                    packed = await client.create(
+                        model=model,
+                        response_model=self.packed_response_model(response_model),
+                        messages=self.get_messages(self.get_packed_user_query(pack)),
+                        validation_context={"labels": self.get_labels()},
+                    )
+                    predictions = self.unpack(pack, packed, response_model)
+                except Exception:
+                    predictions = [None] * len(pack)
+
+            results: List[Optional[BatchPrediction]] = [
+                (
+                    None
+                    if prediction is None
+                    else BatchPrediction(
+                        index=index, query=query, prediction=prediction
+                    )
+                )
+                for index, (query, prediction) in enumerate(
+                    zip(pack, predictions), start
+                )
+            ]
+            # Await only the single-query fallbacks for what the pack missed
+            missing = [i for i, result in enumerate(results) if result is None]
+            fallbacks = await asyncio.gather(
+                *[classify_one(start + i, pack[i]) for i in missing]
+            )
+            for i, result in zip(missing, fallbacks):
+                results[i] = result
+            return results
+
+        packs = await asyncio.gather(
+            *[classify_pack(start) for start in range(0, len(queries), pack_size)]
+        )
+        return [result for pack in packs for result in pack]
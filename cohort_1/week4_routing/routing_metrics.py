@@ -0,0 +1,162 @@
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence
+
+NO_TOOL = "<none>"
+
+
+def func_names(function_call: Any) -> List[str]:
+    return (
+        function_call.func_names
+        if hasattr(function_call, "func_names")
+        else function_call
+    )
+
+
+def encode_calls(
+    function_calls: Sequence[Any], patterns: Dict[tuple, int]
+) -> np.ndarray:
+    """
+    Map each call to the id of its tuple of tool names, adding new tuples to
+    `patterns`. Routing calls use few distinct tool combinations, so this is
+    the only per-call Python work.
+
+    Args:
+        function_calls (Sequence[Any]): FunctionList objects, or lists of tool names.
+        patterns (Dict[tuple, int]): Tuple of tool names -> pattern id, updated in place.
+
+    Returns:
+        np.ndarray: The pattern id of each call.
+    """
+    return np.fromiter(
+        (
+            patterns.setdefault(tuple(func_names(call)), len(patterns))
+            for call in function_calls
+        ),
+        dtype=np.int64,
+        count=len(function_calls),
+    )
+
+
+def multi_hot(function_calls: Sequence[Any], vocabulary: List[str]) -> np.ndarray:
+    """
+    Encode function calls as a multi-hot matrix over the tool vocabulary.
+
+    Args:
+        function_calls (Sequence[Any]): FunctionList objects, or lists of tool names.
+        vocabulary (List[str]): Tool names, one column each. Names outside the
+            vocabulary are ignored.
+
+    Returns:
+        np.ndarray: An (n_calls x n_tools) bool matrix.
+    """
+    column = {name: i for i, name in enumerate(vocabulary)}
+    rows, columns = [], []
+    for row, call in enumerate(function_calls):
+        for name in func_names(call):
+            if name in column:
+                rows.append(row)
+                columns.append(column[name])
+    matrix = np.zeros((len(function_calls), len(vocabulary)), dtype=bool)
+    matrix[rows, columns] = True
+    return matrix
+
+
+def precision_recall_f1(
+    true_positives: np.ndarray, false_positives: np.ndarray, false_negatives: np.ndarray
+) -> Dict[str, np.ndarray]:
+    predicted = true_positives + false_positives
+    expected = true_positives + false_negatives
+    precision = np.divide(
+        true_positives,
+        predicted,
+        out=np.zeros(np.shape(predicted)),
+        where=predicted > 0,
+    )
+    recall = np.divide(
+        true_positives, expected, out=np.zeros(np.shape(expected)), where=expected > 0
+    )
+    total = precision + recall
+    f1 = np.divide(
+        2 * precision * recall, total, out=np.zeros(np.shape(total)), where=total > 0
+    )
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def compute_tool_metrics(
+    desired_function_calls: Sequence[Any],
+    actual_function_calls: Sequence[Any],
+    vocabulary: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Per-tool and averaged routing metrics in one vectorized pass.
+
+    Each call is reduced to the id of its tool combination, and identical
+    (expected, predicted) pairs are counted once. The multi-hot math then runs
+    on the distinct pairs weighted by their counts, which handles millions of
+    logged routing decisions in about a second.
+
+    The confusion matrix has one row and column per tool plus NO_TOOL.
+    Entry [i, j] counts the questions where tool i was expected and tool j was
+    predicted, so the diagonal holds the true positives. The NO_TOOL row and
+    column stand for questions where no tool was expected or predicted.
+
+    Args:
+        desired_function_calls (Sequence[Any]): Expected calls (FunctionList or lists of names).
+        actual_function_calls (Sequence[Any]): Predicted calls, aligned with the expected ones.
+        vocabulary (Optional[List[str]], optional): Tool names to report on. Defaults to
+            every tool seen in either list.
+
+    Returns:
+        Dict[str, Any]: `per_tool` (name -> precision, recall, f1, support), `micro` and
+            `macro` averages, `exact_match`, `labels` and `confusion_matrix`.
+    """
+    n_calls = min(len(desired_function_calls), len(actual_function_calls))
+    patterns: Dict[tuple, int] = {}
+    desired_ids = encode_calls(desired_function_calls[:n_calls], patterns)
+    actual_ids = encode_calls(actual_function_calls[:n_calls], patterns)
+
+    if vocabulary is None:
+        vocabulary = sorted({name for pattern in patterns for name in pattern})
+    n_tools = len(vocabulary)
+    pattern_matrix = multi_hot(list(patterns), vocabulary)
+    pattern_matrix = np.hstack(
+        [pattern_matrix, ~pattern_matrix.any(axis=1, keepdims=True)]
+    )
+
+    pairs, counts = np.unique(
+        desired_ids * max(len(patterns), 1) + actual_ids, return_counts=True
+    )
+    desired = pattern_matrix[pairs // max(len(patterns), 1)]
+    actual = pattern_matrix[pairs % max(len(patterns), 1)]
+
+    confusion = (desired.T * counts) @ actual.astype(np.int64)
+    true_positives = ((desired & actual)[:, :n_tools].T * counts).sum(axis=1)
+    false_positives = ((~desired & actual)[:, :n_tools].T * counts).sum(axis=1)
+    false_negatives = ((desired & ~actual)[:, :n_tools].T * counts).sum(axis=1)
+    exact_matches = int(counts[(desired == actual).all(axis=1)].sum())
+
+    per_tool = precision_recall_f1(true_positives, false_positives, false_negatives)
+    micro = precision_recall_f1(
+        true_positives.sum(), false_positives.sum(), false_negatives.sum()
+    )
+    support = true_positives + false_negatives
+
+    return {
+        "per_tool": {
+            name: {
+                "precision": float(per_tool["precision"][i]),
+                "recall": float(per_tool["recall"][i]),
+                "f1": float(per_tool["f1"][i]),
+                "support": int(support[i]),
+            }
+            for i, name in enumerate(vocabulary)
+        },
+        "micro": {metric: float(value) for metric, value in micro.items()},
+        "macro": {
+            metric: float(values.mean()) if n_tools else 0.0
+            for metric, values in per_tool.items()
+        },
+        "exact_match": exact_matches / n_calls if n_calls else 0.0,
+        "labels": vocabulary + [NO_TOOL],
+        "confusion_matrix": confusion,
+    }
@@ -0,0 +1,64 @@
+import os
+import random
+import time
+
+# utils builds an OpenAI client at import; no request is made in these tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from routing_metrics import compute_tool_metrics
+from utils import (
+    FunctionList,
+    RunningToolMetrics,
+    ToolCallEvaluation,
+    calculate_precision_recall,
+)
+
+TOOLS = ["SearchManual", "CheckOrder", "CompareProducts", "GetWarranty", "Ship"]
+
+
+def random_evaluations(n: int, seed: int = 0):
+    rng = random.Random(seed)
+
+    def call() -> FunctionList:
+        # Duplicated names and empty calls are both allowed
+        return FunctionList(func_names=rng.choices(TOOLS, k=rng.randint(0, 3)))
+
+    return [
+        ToolCallEvaluation(question=f"q{i}", expected=call(), predicted=call())
+        for i in range(n)
+    ]
+
+
+def test_running_metrics_match_batch_metrics_on_a_random_stream():
+    evaluations = random_evaluations(500)
+    metrics = RunningToolMetrics()
+    for i, evaluation in enumerate(evaluations, 1):
+        metrics.update(evaluation)
+        if i % 50 == 0:
+            desired = [e.expected for e in evaluations[:i]]
+            actual = [e.predicted for e in evaluations[:i]]
+            precision, recall = calculate_precision_recall(desired, actual)
+            assert metrics.precision == precision
+            assert metrics.recall == recall
+            batch = compute_tool_metrics(desired, actual)
+            assert metrics.micro == batch["micro"]
+            for metric, value in batch["macro"].items():
+                assert abs(metrics.macro[metric] - value) < 1e-12
+    assert metrics.n_evaluated == len(evaluations)
+
+
+def test_empty_metrics():
+    metrics = RunningToolMetrics()
+    assert metrics.precision == 0.0
+    assert metrics.recall == 0.0
+    assert metrics.macro == {"precision": 0.0, "recall": 0.0, "f1": 0.0}
+
+
+def test_reads_stay_cheap_on_long_streams():
+    # The streaming loop reads the metrics after every update
+    metrics = RunningToolMetrics()
+    start = time.perf_counter()
+    for evaluation in random_evaluations(5000):
+        metrics.update(evaluation)
+        metrics.summary()
+    assert time.perf_counter() - start < 5
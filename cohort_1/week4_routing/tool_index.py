@@ -0,0 +1,108 @@
+import sys
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+sys.path.append("../common")
+from embedding_cache import EmbeddingCache, normalize, openai_embedder
+
+
+def tool_name(tool: Any) -> str:
+    return tool.__name__ if hasattr(tool, "__name__") else tool.__class__.__name__
+
+
+def tool_text(tool: Any) -> str:
+    """
+    The text a tool is retrieved by: its name, docstring and the descriptions
+    of its pydantic fields.
+
+    Args:
+        tool (Any): A tool class, such as one of the FunctionOption models.
+
+    Returns:
+        str: One line for the name and docstring, then one line per described field.
+    """
+    lines = [f"{tool_name(tool)}: {(tool.__doc__ or '').strip()}"]
+    for name, field in getattr(tool, "model_fields", {}).items():
+        if field.description:
+            lines.append(f"- {name}: {field.description}")
+    return "\n".join(lines)
+
+
+class ToolIndex:
+    """
+    Embedding index over a tool catalog, used to put only the top-k candidate
+    tools for each question into the routing prompt.
+
+        index = ToolIndex(FunctionOption.__args__)
+        candidates = index.search(["Would this fit in a 3x7x4 case?"], k=3)[0]
+
+    Tool and question embeddings go through an EmbeddingCache, so rebuilding the
+    index or re-running a benchmark only embeds new text.
+    """
+
+    def __init__(
+        self,
+        tools: Sequence[Any],
+        embedding_cache: Optional[EmbeddingCache] = None,
+        model_name: str = "text-embedding-3-small",
+    ):
+        self.tools = list(tools)
+        self.names = [tool_name(tool) for tool in self.tools]
+        self.embedding_cache = embedding_cache or EmbeddingCache(
+            openai_embedder(model_name), model_name
+        )
+        self.vectors = normalize(
+            self.embedding_cache.embed([tool_text(tool) for tool in self.tools])
+        )
+
+    def search(self, questions: List[str], k: int) -> List[List[Any]]:
+        """
+        Top-k tools for each question, best first. All questions are embedded
+        in one batch and scored with one matrix multiply.
+
+        Args:
+            questions (List[str]): The questions to find tools for.
+            k (int): Number of tools to return per question.
+
+        Returns:
+            List[List[Any]]: For each question, its k most similar tools.
+        """
+        if not questions:
+            return []
+        k = min(k, len(self.tools))
+        scores = normalize(self.embedding_cache.embed(questions)) @ self.vectors.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(
+            -np.take_along_axis(scores, top, axis=1), axis=1, kind="stable"
+        )
+        top = np.take_along_axis(top, order, axis=1)
+        return [[self.tools[i] for i in row] for row in top]
+
+    def recall_at_k(
+        self,
+        questions: List[str],
+        required_tools: List[List[str]],
+        k_values: Sequence[int] = (1, 2, 3, 5),
+    ) -> Dict[int, float]:
+        """
+        Fraction of required tools that appear in each question's top-k.
+
+        Args:
+            questions (List[str]): The questions to search with.
+            required_tools (List[List[str]]): Names of the tools each question needs.
+            k_values (Sequence[int]): The cutoffs to report.
+
+        Returns:
+            Dict[int, float]: Tool recall for each k, pooled over all questions.
+        """
+        candidates = self.search(questions, max(k_values))
+        n_required = sum(len(set(required)) for required in required_tools)
+        recall = {}
+        for k in k_values:
+            found = sum(
+                len(set(required) & {tool_name(tool) for tool in tools[:k]})
+                for required, tools in zip(required_tools, candidates)
+            )
+            recall[k] = found / n_required if n_required else 0.0
+        return recall
@@ -1,11 +1,29 @@
 import asyncio
-from typing import List, Tuple, Any
+import itertools
+import os
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple, Union
 from pydantic import BaseModel
 import instructor
-from openai import AsyncOpenAI
+import numpy as np
+from openai import APIConnectionError, AsyncOpenAI
 
+sys.path.append("../common")
+from adaptive_concurrency import (
+    AdaptiveConcurrencyLimiter,
+    is_overload_error,
+    record_error,
+)
+from llm_cache import cached_client
+from routing_metrics import compute_tool_metrics, func_names, precision_recall_f1
+from tool_index import ToolIndex
 
-async_client = instructor.from_openai(AsyncOpenAI())
+
+# temperature=0 routing calls are cached on disk so metric iterations don't re-call the LLM
+async_client = cached_client(instructor.from_openai(AsyncOpenAI()))
 
 
 class FunctionList(BaseModel):
@@ -63,35 +81,111 @@ def calculate_precision_recall(
     Returns:
         Tuple[float, float]: A tuple containing (precision, recall).
     """
-    true_positives = sum(
-        len(set(desired.func_names) & set(actual.func_names))
-        for desired, actual in zip(desired_function_calls, actual_function_calls)
-    )
-    false_positives = sum(
-        len(set(actual.func_names) - set(desired.func_names))
-        for desired, actual in zip(desired_function_calls, actual_function_calls)
-    )
-    false_negatives = sum(
-        len(set(desired.func_names) - set(actual.func_names))
-        for desired, actual in zip(desired_function_calls, actual_function_calls)
-    )
-
-    precision = (
-        true_positives / (true_positives + false_positives)
-        if (true_positives + false_positives) > 0
-        else 0
-    )
-    recall = (
-        true_positives / (true_positives + false_negatives)
-        if (true_positives + false_negatives) > 0
-        else 0
-    )
+    # Micro-averaged over every (question, tool) pair; see routing_metrics for
+    # per-tool, macro and confusion-matrix metrics
+    micro = compute_tool_metrics(desired_function_calls, actual_function_calls)[
+        "micro"
+    ]
+    precision, recall = micro["precision"], micro["recall"]
 
     return precision, recall
 
 
+def routing_prompt(tool_list: str) -> str:
+    """
+    The system prompt for a routing call.
+
+    Args:
+        tool_list (str): A string describing available tools.
+
+    Returns:
+        str: The system prompt.
+    """
+    return f"""Identify the tools that will help you answer the user's question.
+                    Respond with the names of 0, 1 or 2 tools to use. The available tools are
+                    {tool_list}.
+
+                    Don't make unnecessary function calls.
+                    """
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Count prompt tokens with tiktoken if it's installed, otherwise estimate
+    them as one token per four characters.
+
+    Args:
+        text (str): The text to count.
+        model (str, optional): Model whose tokenizer to use. Defaults to "gpt-4o".
+
+    Returns:
+        int: The number of tokens.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return len(text) // 4
+    return len(tiktoken.encoding_for_model(model).encode(text))
+
+
+def preselect_tool_lists(
+    questions: List[str],
+    tools: List[Any],
+    tool_index: Optional[ToolIndex] = None,
+    top_k: Optional[int] = None,
+) -> List[str]:
+    """
+    Build the tool description for each question's prompt: every tool, or only
+    the top_k tools the index retrieves for that question.
+
+    Args:
+        questions (List[str]): The questions to route.
+        tools (List[Any]): The full tool catalog.
+        tool_index (Optional[ToolIndex], optional): Index to preselect tools with. Defaults to None.
+        top_k (Optional[int], optional): Number of tools to keep per question. Defaults to None (all).
+
+    Returns:
+        List[str]: One describe_tools string per question.
+    """
+    if tool_index is None or top_k is None:
+        return [describe_tools(tools)] * len(questions)
+    return [describe_tools(found) for found in tool_index.search(questions, top_k)]
+
+
+async def route_question(
+    question: str, tool_list: str, client: Optional[instructor.AsyncInstructor] = None
+) -> FunctionList:
+    """
+    Ask the LLM which tools to call for a question. Errors are raised.
+
+    Args:
+        question (str): The user's question.
+        tool_list (str): A string describing available tools.
+        client (Optional[instructor.AsyncInstructor], optional): Client to call. Defaults
+            to the cached async_client.
+
+    Returns:
+        FunctionList: The tools the LLM chose.
+    """
+    client = client if client is not None else async_client
+    return await client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "system",
+                "content": routing_prompt(tool_list),
+            },
+            {"role": "user", "content": question},
+        ],
+        temperature=0.0,
+        response_model=FunctionList,
+    )
+
+
 async def get_one_tool_call_eval(
-    q: QuestionWithTools, tool_list: str
+    q: QuestionWithTools,
+    tool_list: str,
+    client: Optional[instructor.AsyncInstructor] = None,
 ) -> ToolCallEvaluation:
     """
     Get a single tool call evaluation.
@@ -99,30 +193,17 @@ async def get_one_tool_call_eval(
     Args:
         q (QuestionWithTools): The question with required tools.
         tool_list (str): A string describing available tools.
+        client (Optional[instructor.AsyncInstructor], optional): Client to call. Defaults
+            to the cached async_client.
 
     Returns:
         ToolCallEvaluation: The evaluation result.
     """
     try:
-        response = await async_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"""Identify the tools that will help you answer the user's question.
-                    Respond with the names of 0, 1 or 2 tools to use. The available tools are
-                    {tool_list}.
-
-                    Don't make unnecessary function calls.
-                    """,
-                },
-                {"role": "user", "content": q.question},
-            ],
-            temperature=0.0,
-            response_model=FunctionList,
-        )
+        response = await route_question(q.question, tool_list, client)
     except Exception as e:
         print(f"Error in API call: {str(e)}")
+        record_error(e)
         return None
 
     return ToolCallEvaluation(
@@ -134,30 +215,388 @@ async def get_one_tool_call_eval(
 
 async def get_all_tool_call_evals(
     synthetic_questions: List[QuestionWithTools],
-    tool_list: str,
+    tool_list: Union[str, List[str]],
     max_concurrency: int = 40,
+    client: Optional[instructor.AsyncInstructor] = None,
+    latencies: Optional[List[float]] = None,
 ) -> Tuple[List[FunctionList], List[FunctionList]]:
     """
     Get all tool call evaluations for a list of synthetic questions.
 
     Args:
         synthetic_questions (List[QuestionWithTools]): List of synthetic questions.
-        tool_list (str): A string describing available tools.
-        max_concurrency (int, optional): Maximum number of concurrent API calls. Defaults to 40.
+        tool_list (Union[str, List[str]]): A string describing available tools, or one
+            per question (see preselect_tool_lists).
+        max_concurrency (int, optional): Initial number of concurrent API calls. An
+            AdaptiveConcurrencyLimiter raises or lowers it with provider load. Defaults to 40.
+        client (Optional[instructor.AsyncInstructor], optional): Client to call. Defaults
+            to the cached async_client.
+        latencies (Optional[List[float]], optional): If given, the seconds each call took,
+            not counting the wait for a concurrency slot, are appended to it.
 
     Returns:
         Tuple[List[FunctionList], List[FunctionList]]: A tuple containing lists of desired and actual function calls.
     """
-    semaphore = asyncio.Semaphore(max_concurrency)
-
-    async def bounded_get_tool_call_evals(q: QuestionWithTools):
-        async with semaphore:
-            return await get_one_tool_call_eval(q, tool_list)
-
-    tasks = [bounded_get_tool_call_evals(q) for q in synthetic_questions]
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=max_concurrency, name="routing")
+
+    async def bounded_get_tool_call_evals(q: QuestionWithTools, tools: str):
+        async with limiter:
+            start = time.perf_counter()
+            result = await get_one_tool_call_eval(q, tools, client)
+            if latencies is not None:
+                latencies.append(time.perf_counter() - start)
+            return result
+
+    if isinstance(tool_list, str):
+        tool_list = [tool_list] * len(synthetic_questions)
+    tasks = [
+        bounded_get_tool_call_evals(q, tools)
+        for q, tools in zip(synthetic_questions, tool_list)
+    ]
     eval_results = await asyncio.gather(*tasks)
+    print(limiter.summary())
     eval_results = [result for result in eval_results if result is not None]
 
     desired_function_calls = [q.expected for q in eval_results]
     actual_function_calls = [e.predicted for e in eval_results]
     return desired_function_calls, actual_function_calls
+
+
+async def benchmark_tool_preselection(
+    synthetic_questions: List[QuestionWithTools],
+    tools: List[Any],
+    tool_index: ToolIndex,
+    k_values: Sequence[int] = (1, 2, 3, 5),
+    max_concurrency: int = 40,
+    use_cache: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Compare routing with every tool in the prompt against top-k preselection.
+
+    For each k (and for the full catalog) this reports the index's tool recall@k,
+    the mean system prompt tokens, end-to-end routing precision/recall,
+    wall-clock time for the whole run and p50/p95 latency per routing call.
+
+    The response cache is bypassed by default, since cached answers would make
+    every setting after the first run look free. With use_cache=True each row
+    also reports how many calls the cache answered.
+
+    Args:
+        synthetic_questions (List[QuestionWithTools]): List of synthetic questions.
+        tools (List[Any]): The full tool catalog.
+        tool_index (ToolIndex): Index over `tools`.
+        k_values (Sequence[int], optional): Cutoffs to compare. Defaults to (1, 2, 3, 5).
+        max_concurrency (int, optional): Initial number of concurrent API calls. Defaults to 40.
+        use_cache (bool, optional): Route through the cached async_client. Defaults to False.
+
+    Returns:
+        List[Dict[str, Any]]: One row per setting, the full catalog first.
+    """
+    questions = [q.question for q in synthetic_questions]
+    tool_recall = tool_index.recall_at_k(
+        questions,
+        [q.required_tools.func_names for q in synthetic_questions],
+        k_values,
+    )
+
+    client = async_client if use_cache else async_client.client
+    rows = []
+    for k in [None] + list(k_values):
+        tool_lists = preselect_tool_lists(questions, tools, tool_index, k)
+        latencies = []
+        cache_hits = async_client.hits
+        start = time.perf_counter()
+        desired, actual = await get_all_tool_call_evals(
+            synthetic_questions, tool_lists, max_concurrency, client, latencies
+        )
+        seconds = time.perf_counter() - start
+        precision, recall = calculate_precision_recall(desired, actual)
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000 if latencies else (0, 0)
+        rows.append(
+            {
+                "k": len(tools) if k is None else k,
+                "tool_recall_at_k": 1.0 if k is None else tool_recall[k],
+                "prompt_tokens": sum(
+                    count_tokens(routing_prompt(tool_list)) for tool_list in tool_lists
+                )
+                / max(len(tool_lists), 1),
+                "precision": precision,
+                "recall": recall,
+                "seconds": seconds,
+                "questions_per_second": len(questions) / seconds if seconds else 0.0,
+                "latency_p50_ms": float(p50),
+                "latency_p95_ms": float(p95),
+                "cache_hits": async_client.hits - cache_hits,
+            }
+        )
+    return rows
+
+
+class RunningToolMetrics:
+    """
+    Routing metrics over the evaluations seen so far, updated one
+    ToolCallEvaluation at a time.
+
+    Per-tool true positive, false positive and false negative counts are kept
+    with the same set logic as compute_tool_metrics, so an update costs only
+    the tools in that call, and micro and macro averages are derived from the
+    counters. They match compute_tool_metrics (and calculate_precision_recall)
+    on the same evaluations.
+    """
+
+    def __init__(self):
+        self.true_positives: Counter = Counter()
+        self.false_positives: Counter = Counter()
+        self.false_negatives: Counter = Counter()
+        self.n_evaluated = 0
+        self.n_failed = 0
+
+    def update(self, evaluation: ToolCallEvaluation):
+        desired = set(func_names(evaluation.expected))
+        actual = set(func_names(evaluation.predicted))
+        self.true_positives.update(desired & actual)
+        self.false_positives.update(actual - desired)
+        self.false_negatives.update(desired - actual)
+        self.n_evaluated += 1
+
+    @property
+    def tools(self) -> List[str]:
+        return sorted(
+            set(self.true_positives)
+            | set(self.false_positives)
+            | set(self.false_negatives)
+        )
+
+    def _counts(self, tools: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return tuple(
+            np.array([counter[tool] for tool in tools], dtype=np.int64)
+            for counter in (
+                self.true_positives,
+                self.false_positives,
+                self.false_negatives,
+            )
+        )
+
+    @property
+    def micro(self) -> Dict[str, float]:
+        true_positives, false_positives, false_negatives = self._counts(self.tools)
+        micro = precision_recall_f1(
+            true_positives.sum(), false_positives.sum(), false_negatives.sum()
+        )
+        return {metric: float(value) for metric, value in micro.items()}
+
+    @property
+    def macro(self) -> Dict[str, float]:
+        tools = self.tools
+        per_tool = precision_recall_f1(*self._counts(tools))
+        return {
+            metric: float(values.mean()) if tools else 0.0
+            for metric, values in per_tool.items()
+        }
+
+    @property
+    def precision(self) -> float:
+        return self.micro["precision"]
+
+    @property
+    def recall(self) -> float:
+        return self.micro["recall"]
+
+    def summary(self) -> str:
+        return (
+            f"{self.n_evaluated} evaluated, {self.n_failed} failed: "
+            f"precision {self.precision:.2f}, recall {self.recall:.2f}"
+        )
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Whether a routing call is worth retrying: 429s, 5xxs, timeouts and
+    connection errors, including when wrapped by instructor.
+
+    Args:
+        error (BaseException): The error raised by route_question.
+
+    Returns:
+        bool: True if the call should be retried.
+    """
+    if is_overload_error(error):
+        return True
+    while error is not None:
+        if isinstance(error, APIConnectionError):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def read_tool_call_evals(filename: str) -> List[ToolCallEvaluation]:
+    """
+    Read the results file written by stream_tool_call_evals.
+
+    A partial last line, left by a crash mid-write, is truncated away so the
+    file can be appended to again.
+
+    Args:
+        filename (str): Path of the JSONL results file.
+
+    Returns:
+        List[ToolCallEvaluation]: The evaluations in the file, or [] if it doesn't exist.
+    """
+    if not os.path.exists(filename):
+        return []
+
+    evaluations = []
+    complete_bytes = 0
+    with open(filename, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            complete_bytes += len(line)
+            if line.strip():
+                evaluations.append(ToolCallEvaluation.model_validate_json(line))
+
+    if complete_bytes != os.path.getsize(filename):
+        with open(filename, "rb+") as f:
+            f.truncate(complete_bytes)
+    return evaluations
+
+
+async def get_tool_call_eval_with_retries(
+    q: QuestionWithTools,
+    tool_list: str,
+    limiter: AdaptiveConcurrencyLimiter,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+) -> ToolCallEvaluation:
+    """
+    Get a single tool call evaluation, retrying transient failures with full
+    jitter exponential backoff. Other errors, and the last failed attempt, are raised.
+
+    Args:
+        q (QuestionWithTools): The question with required tools.
+        tool_list (str): A string describing available tools.
+        limiter (AdaptiveConcurrencyLimiter): Limiter each attempt runs under.
+        max_retries (int, optional): Retries after the first attempt. Defaults to 5.
+        base_delay (float, optional): Backoff before the first retry, in seconds. Defaults to 1.0.
+        max_delay (float, optional): Maximum backoff, in seconds. Defaults to 30.0.
+
+    Returns:
+        ToolCallEvaluation: The evaluation result.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            # The slot is released while backing off, and the limiter sees the error
+            async with limiter:
+                response = await route_question(q.question, tool_list)
+        except Exception as e:
+            if attempt == max_retries or not is_transient_error(e):
+                raise
+            await asyncio.sleep(
+                random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            )
+        else:
+            return ToolCallEvaluation(
+                question=q.question,
+                expected=q.required_tools,
+                predicted=response,
+            )
+
+
+async def stream_tool_call_evals(
+    synthetic_questions: List[QuestionWithTools],
+    tool_list: Union[str, List[str]],
+    filename: str = "tool_call_evals.jsonl",
+    max_concurrency: int = 40,
+    max_retries: int = 5,
+    resume: bool = True,
+    metrics: Optional[RunningToolMetrics] = None,
+) -> AsyncIterator[Tuple[ToolCallEvaluation, RunningToolMetrics]]:
+    """
+    Streaming version of get_all_tool_call_evals.
+
+    Each ToolCallEvaluation is appended to `filename` as soon as it completes
+    and yielded with the running metrics, so a long benchmark can be watched
+    and stopped at any point:
+
+        async for evaluation, metrics in stream_tool_call_evals(questions, tool_list):
+            if metrics.n_evaluated % 50 == 0:
+                print(metrics.summary())
+
+    With resume=True, questions already in the file are not sent again and
+    their results are counted in the metrics from the start. Transient errors
+    are retried with backoff. Questions that still fail are counted in
+    `metrics.n_failed`, left out of the file, and retried on the next run.
+
+    Args:
+        synthetic_questions (List[QuestionWithTools]): List of synthetic questions.
+        tool_list (Union[str, List[str]]): A string describing available tools, or one
+            per question (see preselect_tool_lists).
+        filename (str, optional): JSONL results file. Defaults to "tool_call_evals.jsonl".
+        max_concurrency (int, optional): Initial number of concurrent API calls. Defaults to 40.
+        max_retries (int, optional): Retries per question for transient errors. Defaults to 5.
+        resume (bool, optional): Keep and skip results already in the file, otherwise
+            overwrite it. Defaults to True.
+        metrics (Optional[RunningToolMetrics], optional): Metrics to update. Pass one to
+            still have the totals when nothing new is yielded, e.g. when rerunning a
+            finished benchmark. Defaults to a new RunningToolMetrics.
+
+    Yields:
+        Tuple[ToolCallEvaluation, RunningToolMetrics]: Each new evaluation and the
+            metrics over every evaluation so far.
+    """
+    metrics = metrics if metrics is not None else RunningToolMetrics()
+    already_evaluated = Counter()
+    if resume:
+        for evaluation in read_tool_call_evals(filename):
+            metrics.update(evaluation)
+            already_evaluated[evaluation.question] += 1
+    else:
+        open(filename, "w").close()
+
+    if isinstance(tool_list, str):
+        tool_list = [tool_list] * len(synthetic_questions)
+    remaining = []
+    for q, tools in zip(synthetic_questions, tool_list):
+        if already_evaluated[q.question] > 0:
+            already_evaluated[q.question] -= 1
+        else:
+            remaining.append((q, tools))
+
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=max_concurrency, name="routing")
+    # Bound how many tasks exist at once, so huge benchmarks stay cheap to stop
+    window = max_concurrency * 4
+    remaining = iter(remaining)
+    pending = set()
+    try:
+        with open(filename, "a") as f:
+            while True:
+                for q, tools in itertools.islice(remaining, window - len(pending)):
+                    pending.add(
+                        asyncio.create_task(
+                            get_tool_call_eval_with_retries(
+                                q, tools, limiter, max_retries=max_retries
+                            )
+                        )
+                    )
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    try:
+                        evaluation = task.result()
+                    except Exception as e:
+                        print(f"Error in API call: {str(e)}")
+                        metrics.n_failed += 1
+                        continue
+                    f.write(evaluation.model_dump_json() + "\n")
+                    f.flush()
+                    metrics.update(evaluation)
+                    yield evaluation, metrics
+    finally:
+        # The consumer stopped early: don't leave requests running
+        for task in pending:
+            task.cancel()
+        print(limiter.summary())
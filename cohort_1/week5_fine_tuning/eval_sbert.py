@@ -1,14 +1,26 @@
 import json
+import os
+import sys
+import time
 import lancedb
 import numpy as np
 from pydantic import BaseModel
 from sentence_transformers.cross_encoder import CrossEncoder
 from typing import List, Tuple
 
+sys.path.append("../week1_bootstrap_evals")
+from candidate_cache import get_candidate_store
+from retrieval_metrics import compute_retrieval_metrics, hit_matrix_from_ranks
+from quantize_reranker import QUANTIZED_MODEL_PATH, load_quantized_reranker
+
 # Constants
 FIRST_STAGE_LIMIT = 50
 BASE_MODEL_PATH = "cross-encoder/stsb-distilroberta-base"
 FINE_TUNED_MODEL_PATH = "./fine_tuned_reranker"
+PREDICT_BATCH_SIZE = 512
+LATENCY_SAMPLE_SIZE = 200
+# Accept the quantized model only if it loses at most this much MRR / recall@10
+MAX_QUANTIZED_QUALITY_DROP = 0.01
 
 
 class EvalQuestion(BaseModel):
@@ -18,13 +30,48 @@ class EvalQuestion(BaseModel):
     question_with_context: str
 
 
-# Load data and setup
-with open("../week1_bootstrap_evals/synthetic_eval_dataset.json", "r") as f:
-    synthetic_questions = json.load(f)
-eval_questions = [EvalQuestion(**q) for q in synthetic_questions]
+# Set by load_eval_data() when run as a script. Kept at module level so the
+# benchmark suite can swap in stand-ins before calling evaluate_model
+eval_questions: List[EvalQuestion] = []
+reviews_table = None
+
+
+def load_eval_data(
+    dataset_path: str = "../week1_bootstrap_evals/synthetic_eval_dataset.json",
+    db_path: str = "../week1_bootstrap_evals/lancedb",
+) -> Tuple[List[EvalQuestion], lancedb.table.LanceTable]:
+    """
+    Load the synthetic eval questions and the reviews table they were made from.
+
+    Args:
+        dataset_path (str, optional): JSON file of synthetic questions.
+        db_path (str, optional): LanceDB directory holding the "reviews" table.
+
+    Returns:
+        Tuple[List[EvalQuestion], lancedb.table.LanceTable]: The questions and the table.
+    """
+    with open(dataset_path, "r") as f:
+        synthetic_questions = json.load(f)
+    db = lancedb.connect(db_path)
+    return [EvalQuestion(**q) for q in synthetic_questions], db.open_table("reviews")
+
+
+def get_first_stage(eval_question: EvalQuestion) -> Tuple[str, np.ndarray, List[str]]:
+    """
+    Build the reranking query for a question and fetch its first-stage candidates.
+
+    Args:
+        eval_question (EvalQuestion): The question to evaluate.
 
-db = lancedb.connect("../week1_bootstrap_evals/lancedb")
-reviews_table = db.open_table("reviews")
+    Returns:
+        Tuple[str, np.ndarray, List[str]]: The query, candidate ids and candidate texts.
+    """
+    query = f"Answer the following question: {eval_question.question_with_context}\n."
+    # Shared with every model we compare, so only the first model pays for the search
+    first_stage = get_candidate_store().get(reviews_table, query, FIRST_STAGE_LIMIT)
+    first_stage_ids = np.array([int(c["id"]) for c in first_stage])
+    review_text = [c["review"] for c in first_stage]
+    return query, first_stage_ids, review_text
 
 
 def score_question(eval_question: EvalQuestion, model: CrossEncoder) -> float:
@@ -38,11 +85,8 @@ def score_question(eval_question: EvalQuestion, model: CrossEncoder) -> float:
     Returns:
         float: The rank of the desired result, or inf if not found.
     """
-    query = f"Answer the following question: {eval_question.question_with_context}\n."
+    query, first_stage_ids, review_text = get_first_stage(eval_question)
     target_id = int(eval_question.chunk_id)
-    first_stage = reviews_table.search(query).limit(FIRST_STAGE_LIMIT).to_pandas()
-    first_stage_ids = first_stage.id.astype(int).values
-    review_text = first_stage.review.values
     reranked_results = model.rank(query, review_text)
     is_right_result = lambda x: first_stage_ids[x["corpus_id"]] == target_id
     try:
@@ -54,6 +98,54 @@ def score_question(eval_question: EvalQuestion, model: CrossEncoder) -> float:
     return rank_of_desired_result
 
 
+def score_questions_batched(
+    eval_questions: List[EvalQuestion],
+    model: CrossEncoder,
+    batch_size: int = PREDICT_BATCH_SIZE,
+) -> List[float]:
+    """
+    Score many questions with one flattened CrossEncoder.predict over all pairs.
+
+    Produces the same ranks as calling score_question on each question, but runs
+    len(pairs) / batch_size forward passes instead of one small pass per question.
+
+    Args:
+        eval_questions (List[EvalQuestion]): The questions to evaluate.
+        model (CrossEncoder): The model to use for ranking.
+        batch_size (int, optional): Number of (query, passage) pairs per forward pass.
+
+    Returns:
+        List[float]: The rank of the desired result for each question, or inf if not found.
+    """
+    first_stages = [get_first_stage(q) for q in eval_questions]
+    pairs = [
+        [query, text] for query, _, review_text in first_stages for text in review_text
+    ]
+    flat_scores = np.asarray(
+        model.predict(pairs, batch_size=batch_size, show_progress_bar=False)
+    )
+    if flat_scores.ndim > 1:
+        flat_scores = flat_scores[:, 0]
+
+    # Pad to an (n_questions x max_candidates) matrix so ranking is one argsort
+    n_candidates = np.array([len(ids) for _, ids, _ in first_stages])
+    max_candidates = n_candidates.max(initial=0)
+    scores = np.full((len(first_stages), max_candidates), -np.inf)
+    candidate_ids = np.full((len(first_stages), max_candidates), -1)
+    mask = np.arange(max_candidates) < n_candidates[:, None]
+    scores[mask] = flat_scores
+    for row, (_, ids, _) in enumerate(first_stages):
+        candidate_ids[row, : len(ids)] = ids
+
+    # Stable sort on negated scores matches the tie order of CrossEncoder.rank
+    order = np.argsort(-scores, axis=1, kind="stable")
+    ranked_ids = np.take_along_axis(candidate_ids, order, axis=1)
+    target_ids = np.array([int(q.chunk_id) for q in eval_questions])
+    hits = (ranked_ids == target_ids[:, None]) & np.take_along_axis(mask, order, axis=1)
+    ranks = np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, np.inf)
+    return ranks.tolist()
+
+
 def mean_reciprocal_rank(ranks: List[float]) -> float:
     """
     Calculate the Mean Reciprocal Rank (MRR) from a list of ranks.
@@ -64,44 +156,132 @@ def mean_reciprocal_rank(ranks: List[float]) -> float:
     Returns:
         float: The Mean Reciprocal Rank.
     """
-    reciprocal_ranks = [1 / rank if rank != np.inf else 0 for rank in ranks]
-    return np.mean(reciprocal_ranks)
+    # 1 / inf is 0, so missing results contribute nothing
+    return float(np.mean(1 / np.asarray(ranks, dtype=float)))
+
+
+def measure_rerank_latency(
+    model: CrossEncoder, n_queries: int = LATENCY_SAMPLE_SIZE, n_warmup: int = 3
+) -> Tuple[float, float]:
+    """
+    Measure per-query rerank latency the way we serve it: one query and its
+    FIRST_STAGE_LIMIT candidates per forward pass. First-stage search is excluded.
+
+    Args:
+        model (CrossEncoder): The model to time.
+        n_queries (int, optional): Number of eval questions to time.
+        n_warmup (int, optional): Untimed queries run first.
+
+    Returns:
+        Tuple[float, float]: p50 and p95 latency in milliseconds.
+    """
+    sample = eval_questions[: n_warmup + n_queries]
+    timings = []
+    for i, eval_question in enumerate(sample):
+        query, _, review_text = get_first_stage(eval_question)
+        pairs = [[query, text] for text in review_text]
+        start = time.perf_counter()
+        model.predict(pairs, batch_size=FIRST_STAGE_LIMIT, show_progress_bar=False)
+        if i >= n_warmup:
+            timings.append((time.perf_counter() - start) * 1000)
+    p50, p95 = np.percentile(timings, [50, 95])
+    return float(p50), float(p95)
 
 
 def evaluate_model(
-    model: CrossEncoder, model_name: str
-) -> Tuple[List[float], float, float]:
+    model: CrossEncoder,
+    model_name: str,
+    batched: bool = True,
+    batch_size: int = PREDICT_BATCH_SIZE,
+) -> Tuple[List[float], float, float, float, float, float]:
     """
     Evaluate a model on the evaluation questions.
 
     Args:
         model (CrossEncoder): The model to evaluate.
         model_name (str): The name of the model for printing results.
+        batched (bool, optional): Score all questions in shared predict batches
+            instead of one model.rank call per question. Defaults to True.
+        batch_size (int, optional): Pairs per forward pass in batched mode.
 
     Returns:
-        Tuple[List[float], float, float]: Ranks, recall at 5, and recall at 10.
+        Tuple[List[float], float, float, float, float, float]: Ranks, recall at 5,
+            recall at 10, MRR, and p50 / p95 per-query rerank latency in ms.
     """
-    ranks = [score_question(eval_question, model) for eval_question in eval_questions]
-    recall_at_5 = np.mean([rank <= 5 for rank in ranks])
-    recall_at_10 = np.mean([rank <= 10 for rank in ranks])
-    mrr = mean_reciprocal_rank(ranks)
+    if batched:
+        ranks = score_questions_batched(eval_questions, model, batch_size)
+    else:
+        ranks = [
+            score_question(eval_question, model) for eval_question in eval_questions
+        ]
+    metrics = compute_retrieval_metrics(
+        hit_matrix_from_ranks(ranks, FIRST_STAGE_LIMIT), [5, 10, FIRST_STAGE_LIMIT]
+    )
+    recall_at_5 = metrics[5]["recall"]
+    recall_at_10 = metrics[10]["recall"]
+    mrr = metrics[FIRST_STAGE_LIMIT]["mrr"]
 
     print(f"{model_name} results:")
     print(f"Recall at 5: {recall_at_5}")
     print(f"Recall at 10: {recall_at_10}")
     print(f"Mean Reciprocal Rank: {mrr:.4f}")
+    print(f"NDCG at 10: {metrics[10]['ndcg']:.4f}")
 
-    return ranks, recall_at_5, recall_at_10, mrr
+    p50_ms, p95_ms = measure_rerank_latency(model)
+    print(f"Rerank latency p50: {p50_ms:.1f} ms, p95: {p95_ms:.1f} ms")
 
+    return ranks, recall_at_5, recall_at_10, mrr, p50_ms, p95_ms
 
-# Evaluate base model
-base_model = CrossEncoder(BASE_MODEL_PATH)
-base_ranks, base_recall_at_5, base_recall_at_10, base_mrr = evaluate_model(
-    base_model, "Base model"
-)
 
-# Evaluate fine-tuned model
-fine_tuned_model = CrossEncoder(FINE_TUNED_MODEL_PATH)
-fine_tuned_ranks, fine_tuned_recall_at_5, fine_tuned_recall_at_10, fine_tuned_mrr = (
-    evaluate_model(fine_tuned_model, "Fine-tuned model")
-)
+if __name__ == "__main__":
+    eval_questions, reviews_table = load_eval_data()
+
+    # Evaluate base model
+    base_model = CrossEncoder(BASE_MODEL_PATH)
+    base_results = evaluate_model(base_model, "Base model")
+    base_ranks, base_recall_at_5, base_recall_at_10, base_mrr = base_results[:4]
+
+    # Evaluate fine-tuned model
+    fine_tuned_model = CrossEncoder(FINE_TUNED_MODEL_PATH)
+    fine_tuned_results = evaluate_model(fine_tuned_model, "Fine-tuned model")
+    (
+        fine_tuned_ranks,
+        fine_tuned_recall_at_5,
+        fine_tuned_recall_at_10,
+        fine_tuned_mrr,
+    ) = fine_tuned_results[:4]
+
+    all_results = {"Base": base_results, "Fine-tuned": fine_tuned_results}
+
+    # Evaluate int8-quantized fine-tuned model (created by quantize_reranker.py)
+    if os.path.exists(QUANTIZED_MODEL_PATH):
+        quantized_model = load_quantized_reranker(QUANTIZED_MODEL_PATH)
+        quantized_results = evaluate_model(
+            quantized_model, "Quantized fine-tuned model"
+        )
+        all_results["Quantized"] = quantized_results
+    else:
+        print(
+            f"No quantized model at '{QUANTIZED_MODEL_PATH}', run quantize_reranker.py"
+        )
+
+    print(f"\n{'Model':<12}{'MRR':>8}{'R@5':>8}{'R@10':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, (_, r5, r10, mrr, p50_ms, p95_ms) in all_results.items():
+        print(
+            f"{name:<12}{mrr:>8.4f}{r5:>8.3f}{r10:>8.3f}{p50_ms:>10.1f}{p95_ms:>10.1f}"
+        )
+
+    if "Quantized" in all_results:
+        _, _, quantized_recall_at_10, quantized_mrr, quantized_p50, _ = (
+            quantized_results
+        )
+        quality_holds = (
+            fine_tuned_mrr - quantized_mrr <= MAX_QUANTIZED_QUALITY_DROP
+            and fine_tuned_recall_at_10 - quantized_recall_at_10
+            <= MAX_QUANTIZED_QUALITY_DROP
+        )
+        speedup = fine_tuned_results[4] / quantized_p50
+        verdict = "accept" if quality_holds else "reject"
+        print(
+            f"Quantized p50 speedup: {speedup:.2f}x, quality holds: {quality_holds} -> {verdict}"
+        )
@@ -1,59 +1,59 @@
 import json
-from sentence_transformers import CrossEncoder, InputExample
+from sentence_transformers import CrossEncoder
 from torch.utils.data import DataLoader
 import lancedb
-from random import randint
 from torch import nn
 from collections import deque
 
+from mine_hard_negatives import ReviewCorpus, mine_hard_negatives
+from token_shards import TokenShardDataset, fit_from_shards, prepare_token_shards
+
 db = lancedb.connect("../week1_bootstrap_evals/lancedb")
-reviews_df = db.open_table("reviews").to_pandas()
-reviews_df.id = reviews_df.id.astype(int)
+corpus = ReviewCorpus(db.open_table("reviews"))
 
 with open("./ft_dataset.jsonl", "r") as f:
     finetune_data = [json.loads(line) for line in f]
 
 neg_examples_per_q = 3
 
-prepared_data = []
-for item in finetune_data:
-    query = item["question_with_context"]
-    chunk_id = int(item["chunk_id"])
-
-    # Fetch the relevant passage from the reviews table
-    relevant_review = reviews_df.loc[chunk_id].review
-
-    prepared_data.append(
-        {
-            "query": query,
-            "positive_passage": relevant_review,
-            "negative_passages": [],
-        }
-    )
-
-    # Add negative examples
-    for _ in range(neg_examples_per_q):
-        random_chunk_id = randint(0, reviews_df.id.max())
-        if random_chunk_id != chunk_id:
-            random_passage = reviews_df.loc[random_chunk_id].review
-            prepared_data[-1]["negative_passages"].append(random_passage)
-
-# Prepare training examples
-train_examples = []
-for item in prepared_data:
-    train_examples.append(
-        InputExample(texts=[item["query"], item["positive_passage"]], label=1.0)
-    )
-    for negative_passage in item["negative_passages"]:
-        train_examples.append(
-            InputExample(texts=[item["query"], negative_passage], label=0.0)
-        )
-
-print(f"Created {len(train_examples)} training examples")
+# Negatives are the most similar reviews that aren't the positive, which teach
+# the model more than random ones. They are mined in batches and cached on disk
+triples = mine_hard_negatives(
+    [item["question_with_context"] for item in finetune_data],
+    [int(item["chunk_id"]) for item in finetune_data],
+    corpus,
+    k=neg_examples_per_q,
+)
+
+
+def training_examples():
+    for triple in triples:
+        yield triple.query, corpus.texts([triple.positive_id])[0], 1.0
+        for negative_passage in corpus.texts(triple.negative_ids):
+            yield triple.query, negative_passage, 0.0
+
 
 # Initialize the model
 model = CrossEncoder("cross-encoder/stsb-distilroberta-base", num_labels=1)
-train_dataloader = DataLoader(train_examples, shuffle=True, batch_size=16)
+max_length = model.max_length or model.tokenizer.model_max_length
+
+# Tokenize every (query, passage) pair once into memory-mapped shards. Later
+# epochs and reruns with the same data read token ids straight from disk
+shard_manifest = prepare_token_shards(
+    training_examples,
+    {
+        "triples": [triple.model_dump() for triple in triples],
+        "table": [corpus.name, corpus.version],
+    },
+    model.tokenizer,
+    max_length,
+)
+print(f"Training on {shard_manifest['n_examples']} pre-tokenized examples")
+
+train_dataset = TokenShardDataset()
+train_dataloader = DataLoader(
+    train_dataset, shuffle=True, batch_size=16, collate_fn=train_dataset.collate
+)
 
 # Train the model
 output_path = "./fine_tuned_reranker"
@@ -86,8 +86,9 @@ class CustomMSELoss(nn.Module):
 
 custom_loss = CustomMSELoss()
 
-model.fit(
-    train_dataloader=train_dataloader,
+fit_from_shards(
+    model,
+    train_dataloader,
     epochs=num_epochs,
     warmup_steps=10,
     optimizer_params={"lr": 2e-5},
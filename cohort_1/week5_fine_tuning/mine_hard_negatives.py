@@ -0,0 +1,191 @@
+import hashlib
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import lancedb
+import numpy as np
+from diskcache import Cache
+from pydantic import BaseModel
+
+sys.path.append("../common")
+from embedding_cache import EmbeddingCache, normalize, openai_embedder
+
+DEFAULT_HARD_NEGATIVE_CACHE_DIR = str(Path(__file__).parent / "hard_negative_cache")
+# The model the week 1 reviews table was embedded with
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Queries scored per matrix multiply. Scores take batch_size x n_reviews floats
+SEARCH_BATCH_SIZE = 1024
+
+
+class MinedTriple(BaseModel):
+    query: str
+    positive_id: int
+    negative_ids: List[int]
+
+
+class ReviewCorpus:
+    """
+    The reviews table loaded once into arrays: integer ids, review texts and
+    L2-normalized vectors, with an id -> row lookup. Mining searches these
+    arrays directly, so there is no per-query table call or DataFrame lookup.
+    """
+
+    def __init__(self, table: lancedb.table.LanceTable, vector_column: str = "vector"):
+        reviews_df = table.to_pandas()
+        self.name = getattr(table, "name", None)
+        self.version = getattr(table, "version", None)
+        self.ids = reviews_df.id.astype(int).to_numpy()
+        self.reviews = reviews_df.review.tolist()
+        self.vectors = normalize(np.stack(reviews_df[vector_column].to_numpy()))
+        self.rows: Dict[int, int] = {
+            int(review_id): row for row, review_id in enumerate(self.ids)
+        }
+
+    def texts(self, ids: Sequence[int]) -> List[str]:
+        return [self.reviews[self.rows[int(review_id)]] for review_id in ids]
+
+
+class HardNegativeStore:
+    """
+    Persistent store of mined negative ids, one entry per (query, positive).
+
+    Entries are keyed by the query, its positive id, the table name and
+    version, the embedding model and k, so re-running after new queries are
+    added only mines the new ones, and changing the table remines everything.
+    """
+
+    def __init__(self, directory: str = DEFAULT_HARD_NEGATIVE_CACHE_DIR):
+        self.cache = Cache(directory)
+
+    @staticmethod
+    def make_key(
+        query: str, positive_id: int, corpus: ReviewCorpus, model_name: str, k: int
+    ) -> str:
+        payload = json.dumps(
+            {
+                "query": query,
+                "positive_id": int(positive_id),
+                "table": corpus.name,
+                "version": corpus.version,
+                "model": model_name,
+                "k": k,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[int]]]:
+        return [self.cache.get(key) for key in keys]
+
+    def set_many(self, keys: List[str], negative_ids: List[List[int]]):
+        with self.cache.transact():
+            for key, ids in zip(keys, negative_ids):
+                self.cache.set(key, ids)
+
+
+def top_k_negatives(
+    query_vectors: np.ndarray, positive_rows: np.ndarray, corpus: ReviewCorpus, k: int
+) -> np.ndarray:
+    """
+    Ids of the k reviews most similar to each query, excluding its positive.
+
+    Args:
+        query_vectors (np.ndarray): L2-normalized query vectors, one row per query.
+        positive_rows (np.ndarray): Corpus row of each query's positive, or -1.
+        corpus (ReviewCorpus): The reviews to search.
+        k (int): Negatives per query.
+
+    Returns:
+        np.ndarray: A (n_queries x k) array of review ids, most similar first.
+    """
+    scores = query_vectors @ corpus.vectors.T
+    has_positive = positive_rows >= 0
+    scores[np.flatnonzero(has_positive), positive_rows[has_positive]] = -np.inf
+    k = min(k, len(corpus.ids) - 1)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return corpus.ids[np.take_along_axis(top, order, axis=1)]
+
+
+def mine_hard_negatives(
+    queries: List[str],
+    positive_ids: List[int],
+    corpus: ReviewCorpus,
+    k: int = 3,
+    embedding_cache: Optional[EmbeddingCache] = None,
+    store: Optional[HardNegativeStore] = None,
+    batch_size: int = SEARCH_BATCH_SIZE,
+) -> List[MinedTriple]:
+    """
+    Mine the k most similar non-positive reviews of each query as hard negatives.
+
+    Only (query, positive) pairs missing from the store are mined. Their
+    queries are embedded through the EmbeddingCache, and each batch of
+    `batch_size` queries is searched against the whole corpus with a single
+    matrix multiply.
+
+    Args:
+        queries (List[str]): The training queries.
+        positive_ids (List[int]): The id of the relevant review for each query.
+        corpus (ReviewCorpus): The reviews to mine negatives from.
+        k (int, optional): Negatives per query. Defaults to 3.
+        embedding_cache (Optional[EmbeddingCache], optional): Embeds the queries.
+            Defaults to OpenAI EMBEDDING_MODEL, the model the table was built with.
+        store (Optional[HardNegativeStore], optional): Where mined ids are cached.
+        batch_size (int, optional): Queries searched per matrix multiply.
+
+    Returns:
+        List[MinedTriple]: One (query, positive, negatives) triple per query, in input order.
+    """
+    embedding_cache = embedding_cache or EmbeddingCache(
+        openai_embedder(EMBEDDING_MODEL), EMBEDDING_MODEL
+    )
+    store = store or HardNegativeStore()
+    keys = [
+        store.make_key(query, positive_id, corpus, embedding_cache.model_name, k)
+        for query, positive_id in zip(queries, positive_ids)
+    ]
+    negative_ids = store.get_many(keys)
+    missing = [i for i, ids in enumerate(negative_ids) if ids is None]
+
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start : start + batch_size]
+        query_vectors = normalize(embedding_cache.embed([queries[i] for i in batch]))
+        positive_rows = np.array(
+            [corpus.rows.get(int(positive_ids[i]), -1) for i in batch]
+        )
+        mined = top_k_negatives(query_vectors, positive_rows, corpus, k).tolist()
+        store.set_many([keys[i] for i in batch], mined)
+        for i, ids in zip(batch, mined):
+            negative_ids[i] = ids
+
+    return [
+        MinedTriple(query=query, positive_id=int(positive_id), negative_ids=ids)
+        for query, positive_id, ids in zip(queries, positive_ids, negative_ids)
+    ]
+
+
+if __name__ == "__main__":
+    db = lancedb.connect("../week1_bootstrap_evals/lancedb")
+    corpus = ReviewCorpus(db.open_table("reviews"))
+    with open("./ft_dataset.jsonl", "r") as f:
+        finetune_data = [json.loads(line) for line in f]
+
+    start = time.perf_counter()
+    triples = mine_hard_negatives(
+        [item["question_with_context"] for item in finetune_data],
+        [int(item["chunk_id"]) for item in finetune_data],
+        corpus,
+    )
+    print(
+        f"Mined hard negatives for {len(triples)} queries "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    example = triples[0]
+    print(f"Query: {example.query}")
+    print(f"Positive: {corpus.texts([example.positive_id])[0]}")
+    for passage in corpus.texts(example.negative_ids):
+        print(f"Hard negative: {passage}")
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import torch
+from torch import nn
+from sentence_transformers import CrossEncoder
+from transformers import AutoConfig, AutoModelForSequenceClassification
+
+FINE_TUNED_MODEL_PATH = "./fine_tuned_reranker"
+QUANTIZED_MODEL_PATH = "./fine_tuned_reranker_int8"
+QUANTIZED_WEIGHTS_FILE = "quantized_state_dict.pt"
+
+
+def quantize(model: CrossEncoder) -> CrossEncoder:
+    """
+    Apply torch dynamic int8 quantization to the linear layers of a CrossEncoder.
+
+    Weights are stored as int8 and activations are quantized on the fly, which
+    speeds up CPU inference without any calibration data. CrossEncoder.model is
+    a read-only view of the wrapped transformer, so the quantized copy replaces
+    the transformer held by the CrossEncoder's Transformer module.
+
+    Args:
+        model (CrossEncoder): The model to quantize in place.
+
+    Returns:
+        CrossEncoder: The same CrossEncoder, wrapping the quantized transformer.
+    """
+    for module in model:
+        if hasattr(module, "auto_model"):
+            module.model = torch.quantization.quantize_dynamic(
+                module.model, {nn.Linear}, dtype=torch.qint8
+            )
+    assert any(
+        isinstance(layer, nn.quantized.dynamic.Linear)
+        for layer in model.model.modules()
+    ), "No linear layers were quantized"
+    return model
+
+
+def save_quantized_reranker(
+    model_path: str = FINE_TUNED_MODEL_PATH,
+    output_path: str = QUANTIZED_MODEL_PATH,
+) -> str:
+    """
+    Quantize a saved CrossEncoder and write it as a separate artifact.
+
+    The output directory holds only the transformer config, the tokenizer and
+    the int8 state dict, so no fp32 weights ship with it.
+
+    Args:
+        model_path (str): Path of the fp32 model to quantize.
+        output_path (str): Directory to write the quantized artifact to.
+
+    Returns:
+        str: The output path.
+    """
+    model = CrossEncoder(model_path, device="cpu")
+    os.makedirs(output_path, exist_ok=True)
+    model.model.config.save_pretrained(output_path)
+    model.tokenizer.save_pretrained(output_path)
+    quantize(model)
+    torch.save(
+        model.model.state_dict(), os.path.join(output_path, QUANTIZED_WEIGHTS_FILE)
+    )
+    return output_path
+
+
+def load_quantized_reranker(path: str = QUANTIZED_MODEL_PATH) -> CrossEncoder:
+    """
+    Load an artifact written by save_quantized_reranker.
+
+    CrossEncoder only loads from a full checkpoint, so it is first built from a
+    randomly initialized model with the saved config, then quantized and given
+    the int8 weights.
+
+    Args:
+        path (str): Directory of the quantized artifact.
+
+    Returns:
+        CrossEncoder: A CrossEncoder with int8 linear layers.
+    """
+    with tempfile.TemporaryDirectory() as checkpoint:
+        shutil.copytree(path, checkpoint, dirs_exist_ok=True)
+        os.remove(os.path.join(checkpoint, QUANTIZED_WEIGHTS_FILE))
+        AutoModelForSequenceClassification.from_config(
+            AutoConfig.from_pretrained(path)
+        ).save_pretrained(checkpoint)
+        model = quantize(CrossEncoder(checkpoint, device="cpu"))
+    model.model.load_state_dict(
+        torch.load(os.path.join(path, QUANTIZED_WEIGHTS_FILE), weights_only=False)
+    )
+    model.model.eval()
+    return model
+
+
+if __name__ == "__main__":
+    save_quantized_reranker()
+    print(f"Quantized model saved to '{QUANTIZED_MODEL_PATH}'.")
@@ -0,0 +1,366 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, Dataset
+from tqdm.auto import tqdm
+from transformers import get_linear_schedule_with_warmup
+
+DEFAULT_SHARD_DIR = "./token_shards"
+MANIFEST_FILE = "manifest.json"
+# Examples per shard file, and (query, passage) pairs per tokenizer call
+SHARD_SIZE = 50_000
+TOKENIZE_BATCH_SIZE = 1024
+
+# (query, passage, label)
+Example = Tuple[str, str, float]
+
+
+def shards_fingerprint(data_key: Any, tokenizer: Any, max_length: int) -> str:
+    """
+    Identify a set of shards by the data they hold and how it was tokenized.
+
+    Args:
+        data_key (Any): JSON-serializable description of the examples, such as
+            the mined triples and the reviews table version.
+        tokenizer (Any): The Hugging Face tokenizer the shards are built with.
+        max_length (int): Pairs are truncated to this many tokens.
+
+    Returns:
+        str: A hex digest; shards are rebuilt whenever it changes.
+    """
+    payload = json.dumps(
+        {
+            "data": data_key,
+            "tokenizer": tokenizer.name_or_path,
+            "vocab_size": len(tokenizer),
+            "max_length": max_length,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_shard(directory: str, name: str, columns: Dict[str, List[np.ndarray]]):
+    shard_dir = os.path.join(directory, name)
+    os.makedirs(shard_dir)
+    lengths = np.array([len(ids) for ids in columns["input_ids"]], dtype=np.int64)
+    np.save(
+        os.path.join(shard_dir, "offsets.npy"),
+        np.concatenate([[0], np.cumsum(lengths)]),
+    )
+    np.save(
+        os.path.join(shard_dir, "labels.npy"),
+        np.array(columns["labels"], dtype=np.float32),
+    )
+    for column in ("input_ids", "token_type_ids"):
+        if columns.get(column):
+            np.save(
+                os.path.join(shard_dir, f"{column}.npy"),
+                np.concatenate(columns[column]),
+            )
+
+
+def write_token_shards(
+    examples: Iterable[Example],
+    tokenizer: Any,
+    directory: str,
+    max_length: int,
+    fingerprint: str,
+    shard_size: int = SHARD_SIZE,
+    batch_size: int = TOKENIZE_BATCH_SIZE,
+) -> Dict[str, Any]:
+    """
+    Tokenize (query, passage, label) examples once into memory-mapped shards.
+
+    Each shard stores the token ids of all its pairs back to back in one flat
+    array (plus token type ids, if the tokenizer makes them), with an offsets
+    array marking where each pair starts, and the labels. Pairs are not padded:
+    the attention mask is all ones over a pair's tokens, so TokenShardDataset
+    rebuilds it per batch instead of storing it. Ids are stored as uint16
+    when the vocabulary fits, halving the size on disk.
+
+    Examples are consumed as a stream and at most one shard is held in memory.
+    The manifest is written last, so an interrupted run is never mistaken for
+    complete shards.
+
+    Args:
+        examples (Iterable[Example]): (query, passage, label) tuples.
+        tokenizer (Any): A Hugging Face tokenizer, e.g. CrossEncoder.tokenizer.
+        directory (str): Output directory. Anything already in it is replaced.
+        max_length (int): Pairs are truncated to this many tokens.
+        fingerprint (str): Stored in the manifest, see shards_fingerprint.
+        shard_size (int, optional): Examples per shard.
+        batch_size (int, optional): Pairs per tokenizer call.
+
+    Returns:
+        Dict[str, Any]: The manifest.
+    """
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.int32
+
+    shards = []
+    columns: Dict[str, List] = {"input_ids": [], "token_type_ids": [], "labels": []}
+
+    def flush():
+        if columns["labels"]:
+            name = f"shard_{len(shards):05d}"
+            write_shard(directory, name, columns)
+            shards.append({"name": name, "n_examples": len(columns["labels"])})
+            for values in columns.values():
+                values.clear()
+
+    def tokenize(batch: List[Example]):
+        encoded = tokenizer(
+            [query for query, _, _ in batch],
+            [passage for _, passage, _ in batch],
+            truncation=True,
+            max_length=max_length,
+        )
+        columns["input_ids"].extend(
+            np.asarray(ids, dtype=dtype) for ids in encoded["input_ids"]
+        )
+        if "token_type_ids" in encoded:
+            columns["token_type_ids"].extend(
+                np.asarray(ids, dtype=np.uint8) for ids in encoded["token_type_ids"]
+            )
+        columns["labels"].extend(label for _, _, label in batch)
+
+    batch: List[Example] = []
+    for example in examples:
+        batch.append(example)
+        shard_full = len(columns["labels"]) + len(batch) == shard_size
+        if len(batch) == batch_size or shard_full:
+            tokenize(batch)
+            batch = []
+            if shard_full:
+                flush()
+    if batch:
+        tokenize(batch)
+    flush()
+
+    manifest = {
+        "fingerprint": fingerprint,
+        "tokenizer": tokenizer.name_or_path,
+        "max_length": max_length,
+        "pad_token_id": tokenizer.pad_token_id,
+        "n_examples": sum(shard["n_examples"] for shard in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def prepare_token_shards(
+    examples: Callable[[], Iterable[Example]],
+    data_key: Any,
+    tokenizer: Any,
+    max_length: int,
+    directory: str = DEFAULT_SHARD_DIR,
+    shard_size: int = SHARD_SIZE,
+) -> Dict[str, Any]:
+    """
+    Return the manifest of up-to-date shards in `directory`, tokenizing only
+    when the data, tokenizer or max_length changed since they were written.
+
+    Args:
+        examples (Callable[[], Iterable[Example]]): Makes the example stream. Only
+            called when the shards have to be rebuilt.
+        data_key (Any): JSON-serializable description of the examples.
+        tokenizer (Any): The Hugging Face tokenizer to use.
+        max_length (int): Pairs are truncated to this many tokens.
+        directory (str, optional): Where the shards live.
+        shard_size (int, optional): Examples per shard.
+
+    Returns:
+        Dict[str, Any]: The shard manifest.
+    """
+    fingerprint = shards_fingerprint(data_key, tokenizer, max_length)
+    manifest = read_manifest(directory)
+    if manifest is not None and manifest["fingerprint"] == fingerprint:
+        return manifest
+    return write_token_shards(
+        examples(), tokenizer, directory, max_length, fingerprint, shard_size
+    )
+
+
+class TokenShardDataset(Dataset):
+    """
+    Pre-tokenized (query, passage) pairs read from shards made by
+    write_token_shards. Arrays are memory-mapped, so memory use stays flat no
+    matter how many examples there are, and nothing is tokenized during
+    training. Use `collate` as the DataLoader's collate_fn.
+
+        dataset = TokenShardDataset("./token_shards")
+        loader = DataLoader(dataset, batch_size=16, shuffle=True, collate_fn=dataset.collate)
+    """
+
+    def __init__(self, directory: str = DEFAULT_SHARD_DIR):
+        manifest = read_manifest(directory)
+        if manifest is None:
+            raise FileNotFoundError(f"No token shards in '{directory}'")
+        self.directory = directory
+        self.shards = manifest["shards"]
+        self.pad_token_id = manifest["pad_token_id"]
+        self.starts = np.cumsum([0] + [shard["n_examples"] for shard in self.shards])
+        # Opened on first access, so each DataLoader worker maps its own
+        self._arrays: Optional[List[Dict[str, np.ndarray]]] = None
+
+    def _open(self) -> List[Dict[str, np.ndarray]]:
+        arrays = []
+        for shard in self.shards:
+            shard_dir = os.path.join(self.directory, shard["name"])
+            arrays.append(
+                {
+                    file[: -len(".npy")]: np.load(
+                        os.path.join(shard_dir, file), mmap_mode="r"
+                    )
+                    for file in os.listdir(shard_dir)
+                    if file.endswith(".npy")
+                }
+            )
+        return arrays
+
+    def __getstate__(self):
+        return {**self.__dict__, "_arrays": None}
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        if self._arrays is None:
+            self._arrays = self._open()
+        shard = int(np.searchsorted(self.starts, index, side="right")) - 1
+        arrays = self._arrays[shard]
+        row = index - self.starts[shard]
+        start, end = arrays["offsets"][row], arrays["offsets"][row + 1]
+        item = {
+            "input_ids": arrays["input_ids"][start:end],
+            "label": float(arrays["labels"][row]),
+        }
+        if "token_type_ids" in arrays:
+            item["token_type_ids"] = arrays["token_type_ids"][start:end]
+        return item
+
+    def collate(
+        self, batch: List[Dict[str, Any]]
+    ) -> Tuple[Dict[str, torch.Tensor], torch.Tensor]:
+        """
+        Pad a batch to its longest pair, like CrossEncoder.smart_batching_collate.
+
+        Returns:
+            Tuple[Dict[str, torch.Tensor], torch.Tensor]: Model inputs
+                (input_ids, attention_mask and token_type_ids if stored) and labels.
+        """
+        max_length = max(len(item["input_ids"]) for item in batch)
+        input_ids = np.full((len(batch), max_length), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(batch), max_length), dtype=np.int64)
+        token_type_ids = np.zeros((len(batch), max_length), dtype=np.int64)
+        for row, item in enumerate(batch):
+            length = len(item["input_ids"])
+            input_ids[row, :length] = item["input_ids"]
+            attention_mask[row, :length] = 1
+            if "token_type_ids" in item:
+                token_type_ids[row, :length] = item["token_type_ids"]
+
+        features = {
+            "input_ids": torch.from_numpy(input_ids),
+            "attention_mask": torch.from_numpy(attention_mask),
+        }
+        if "token_type_ids" in batch[0]:
+            features["token_type_ids"] = torch.from_numpy(token_type_ids)
+        labels = torch.tensor([item["label"] for item in batch], dtype=torch.float32)
+        return features, labels
+
+
+def fit_from_shards(
+    model: Any,
+    train_dataloader: DataLoader,
+    epochs: int = 1,
+    warmup_steps: int = 0,
+    optimizer_params: Optional[Dict[str, Any]] = None,
+    weight_decay: float = 0.01,
+    max_grad_norm: float = 1.0,
+    loss_fct: Optional[nn.Module] = None,
+    show_progress_bar: bool = True,
+):
+    """
+    Train a CrossEncoder on batches from TokenShardDataset.collate.
+
+    CrossEncoder.fit tokenizes InputExamples in its own collate function, so
+    it can't take pre-tokenized batches. This is the same loop (AdamW without
+    weight decay on biases and LayerNorm, linear warmup then decay, gradient
+    clipping) over the model's underlying transformer.
+
+    Args:
+        model (Any): The CrossEncoder to train, in place.
+        train_dataloader (DataLoader): Yields (features, labels) batches.
+        epochs (int, optional): Passes over the data.
+        warmup_steps (int, optional): Steps of linear learning rate warmup.
+        optimizer_params (Optional[Dict[str, Any]], optional): AdamW arguments.
+            Defaults to {"lr": 2e-5}.
+        weight_decay (float, optional): AdamW weight decay.
+        max_grad_norm (float, optional): Gradients are clipped to this norm.
+        loss_fct (Optional[nn.Module], optional): Called as loss_fct(logits, labels).
+            Defaults to BCEWithLogitsLoss, CrossEncoder's default for one label.
+        show_progress_bar (bool, optional): Show a tqdm bar per epoch.
+    """
+    transformer = model.model
+    # Newer sentence-transformers expose .device; older ones only _target_device
+    device = getattr(model, "device", None) or model._target_device
+    transformer.to(device)
+    loss_fct = loss_fct or nn.BCEWithLogitsLoss()
+
+    no_decay = ["bias", "LayerNorm.bias", "LayerNorm.weight"]
+    parameters = list(transformer.named_parameters())
+    optimizer = torch.optim.AdamW(
+        [
+            {
+                "params": [
+                    p for n, p in parameters if not any(nd in n for nd in no_decay)
+                ],
+                "weight_decay": weight_decay,
+            },
+            {
+                "params": [p for n, p in parameters if any(nd in n for nd in no_decay)],
+                "weight_decay": 0.0,
+            },
+        ],
+        **(optimizer_params or {"lr": 2e-5}),
+    )
+    scheduler = get_linear_schedule_with_warmup(
+        optimizer, warmup_steps, len(train_dataloader) * epochs
+    )
+
+    transformer.train()
+    for epoch in range(epochs):
+        for features, labels in tqdm(
+            train_dataloader, desc=f"Epoch {epoch + 1}", disable=not show_progress_bar
+        ):
+            features = {name: tensor.to(device) for name, tensor in features.items()}
+            logits = transformer(**features, return_dict=True).logits
+            if logits.shape[-1] == 1:
+                logits = logits.view(-1)
+            loss = loss_fct(logits, labels.to(device))
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(transformer.parameters(), max_grad_norm)
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+    transformer.eval()